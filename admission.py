@@ -0,0 +1,208 @@
+from printer_labels import PRINTER_LABELS, BitmapLabels
+from symbologies import get_backend
+from vector_barcodes import VECTOR_BARCODES, VECTOR_2D_BARCODES
+
+import math
+import threading
+import time
+
+
+# Admission control for /generate. Every request is priced up front by
+# estimate_cost() in rough milliseconds of render time on one core, and
+# runs only while its lane has budget left for it:
+#
+# - the fast lane takes requests up to request_budget, as long as the
+#   requests already running in it add up to no more than global_budget;
+# - larger requests go to the slow lane, with a budget of its own, so they
+#   are never in the way of small interactive ones. A slow-lane request is
+#   always let in when that lane is empty, however large;
+# - anything over max_cost is refused outright (413).
+#
+# A request that doesn't fit waits up to queue_timeout seconds for room,
+# then gets a 429 with a Retry-After guess. So does one that arrives when
+# max_waiting requests are already waiting in its lane.
+
+# ms per symbol at 300 dpi, as measured on the reference box
+RASTER_SYMBOL_MS = {"qrcode": 9, "datamatrix": 70}  # stacked; scaled with dpi
+TREEPOEM_SYMBOL_MS = 5  # a share of one Ghostscript batch
+MODULE_SYMBOL_MS = {"qrcode": 4, "datamatrix": 1}  # drawn from modules (vector, bitmap pages)
+LINEAR_MODULE_MS = 0.5
+NATIVE_SYMBOL_MS = 0.1  # a ZPL/EPL barcode command; the printer draws it
+TEXT_MS = 0.1
+PAGE_MS = 0.5
+BITMAP_PAGE_MS_PER_MEGAPIXEL = 15
+
+
+def symbol_ms(barcode_type, layout, render_mode, output_format, dpi):
+    if barcode_type == "none" or layout == "textonly":
+        return 0
+    writer = PRINTER_LABELS.get(output_format)
+    if writer is not None and not writer.sends_graphic(barcode_type):
+        if issubclass(writer, BitmapLabels):
+            return MODULE_SYMBOL_MS.get(barcode_type, LINEAR_MODULE_MS)
+        return NATIVE_SYMBOL_MS
+    if writer is None and render_mode == "vector" and (
+        barcode_type in VECTOR_BARCODES or barcode_type in VECTOR_2D_BARCODES
+    ):
+        return MODULE_SYMBOL_MS.get(barcode_type, LINEAR_MODULE_MS)
+    if layout == "stacked" and writer is None and barcode_type in RASTER_SYMBOL_MS:
+        # built at its final pixel size
+        return RASTER_SYMBOL_MS[barcode_type] * (dpi / 300) ** 2
+    if get_backend(barcode_type).treepoem:
+        return TREEPOEM_SYMBOL_MS
+    return RASTER_SYMBOL_MS["qrcode"]
+
+
+def estimate_cost(options):
+    # rough ms of render time for generate_labels(**options)
+    pages = max(0, options["quantity"])
+    labels = pages * options.get("rows", 1) * options.get("columns", 1)
+    layout = options.get("layout_mode", "stacked").lower()
+    output_format = options.get("output_format", "pdf")
+    dpi = options.get("dpi", 300)
+
+    # symbols are built once per distinct SKU
+    symbols = labels
+    sku_list = options.get("sku_list")
+    if options.get("use_manual_preview") and isinstance(sku_list, list) and sku_list:
+        symbols = min(labels, len(sku_list))
+    cost = symbols * symbol_ms(options["barcode_type"], layout, options.get("render_mode", "raster"), output_format, dpi)
+
+    if layout != "barcodeonly":
+        cost += labels * TEXT_MS
+    writer = PRINTER_LABELS.get(output_format)
+    if writer is not None and issubclass(writer, BitmapLabels):
+        megapixels = options.get("label_width", 4) * options.get("label_height", 6) * dpi * dpi / 1e6
+        cost += pages * megapixels * BITMAP_PAGE_MS_PER_MEGAPIXEL
+    else:
+        cost += pages * PAGE_MS
+    return cost
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message, status=429, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    def response(self):
+        # a Flask view return value
+        headers = {"Retry-After": str(self.retry_after)} if self.retry_after else {}
+        return {"error": str(self)}, self.status, headers
+
+
+class Lane:
+    def __init__(self, name, budget):
+        self.name = name
+        self.budget = budget
+        self.in_flight = 0
+        self.running = 0
+        self.waiting = 0
+
+    def fits(self, cost):
+        return self.running == 0 or self.in_flight + cost <= self.budget
+
+
+class Ticket:
+    # an admitted request; release() (or leaving the with block) gives its
+    # cost back. Releasing twice is harmless.
+    def __init__(self, controller, lane, cost, waited):
+        self.controller = controller
+        self.lane = lane
+        self.cost = cost
+        self.waited = waited
+        self._released = False
+
+    def release(self):
+        with self.controller._cond:
+            if self._released:
+                return
+            self._released = True
+            self.lane.in_flight -= self.cost
+            self.lane.running -= 1
+            self.controller._cond.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    def __init__(self, request_budget=20_000, global_budget=60_000, slow_budget=600_000,
+                 max_cost=1_800_000, queue_timeout=10, max_waiting=32):
+        self.request_budget = request_budget
+        self.max_cost = max_cost
+        self.queue_timeout = queue_timeout
+        self.max_waiting = max_waiting
+        self.fast = Lane("fast", global_budget)
+        self.slow = Lane("slow", slow_budget)
+        self._cond = threading.Condition()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.too_large = 0
+        self.wait_seconds = 0.0
+
+    def check_size(self, cost):
+        if cost > self.max_cost:
+            with self._cond:
+                self.too_large += 1
+            raise AdmissionRejected(
+                f"Request too large: about {cost / 1000:.0f}s of rendering, the limit is "
+                f"{self.max_cost / 1000:.0f}s. Use fewer labels, a lower dpi or vector rendering.",
+                status=413,
+            )
+
+    def admit(self, cost):
+        # a Ticket once the request's lane has room, or AdmissionRejected
+        self.check_size(cost)
+        lane = self.fast if cost <= self.request_budget else self.slow
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        with self._cond:
+            if not lane.fits(cost):
+                if lane.waiting >= self.max_waiting:
+                    raise self._reject(lane)
+                self.queued += 1
+                lane.waiting += 1
+                try:
+                    while not lane.fits(cost):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise self._reject(lane)
+                        self._cond.wait(remaining)
+                finally:
+                    lane.waiting -= 1
+            lane.in_flight += cost
+            lane.running += 1
+            waited = time.monotonic() - started
+            self.admitted += 1
+            self.wait_seconds += waited
+        return Ticket(self, lane, cost, waited)
+
+    def _reject(self, lane):
+        # called with the lock held
+        self.rejected += 1
+        # about when the work ahead of it should be done
+        retry_after = max(1, min(60, math.ceil(lane.in_flight / 1000 / max(1, lane.running))))
+        if lane is self.slow:
+            message = "Large requests run a few at a time and that lane is full; retry later or submit it to /jobs."
+        else:
+            message = "Too many labels are being rendered right now; retry shortly."
+        return AdmissionRejected(message, 429, retry_after)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "too_large": self.too_large,
+                "wait_seconds": self.wait_seconds,
+                "fast_in_flight_ms": self.fast.in_flight,
+                "fast_waiting": self.fast.waiting,
+                "slow_in_flight_ms": self.slow.in_flight,
+                "slow_waiting": self.slow.waiting,
+            }
@@ -1,13 +1,69 @@
 from flask import Flask, request, send_file, render_template_string
-from flask import send_from_directory
-from generator import generate_labels
-from generator import parse_sku_list
-import re
+from flask import Response, send_from_directory
+from admission import AdmissionController, AdmissionRejected, estimate_cost
+from document_cache import DocumentCache, document_key
+from generator import barcode_cache, generate_labels, manual_sku_errors, rng_sku_error, stream_labels
+from jobs import JobQueue, JobQueueFull
+from printer_labels import OUTPUT_FORMATS
+from preview import PREVIEW_WIDTH_PX, preview_options, render_preview
+from request_options import as_bool, label_options, seed_option
+from sku_index import IssuedSkuIndex
+from sku_sources import SkuFile
+from symbologies import warm_up
+from timing import StageTimer, stage_metrics
+import os
 import tempfile
 
 
 app = Flask(__name__)
 
+# Per-stage timing of label runs (Server-Timing header, /metrics).
+# LABEL_TIMING=0 turns it off; generate_labels then runs unwrapped.
+TIMING_ENABLED = os.environ.get("LABEL_TIMING", "1") != "0"
+
+# Set SKU_INDEX_PATH to a SQLite file to never reissue a random SKU across
+# runs. Previews don't draw from it.
+sku_index = IssuedSkuIndex(os.environ["SKU_INDEX_PATH"]) if os.environ.get("SKU_INDEX_PATH") else None
+
+# Symbology libraries are imported on first use. PRELOAD_BACKENDS=all (or
+# a comma-separated list of barcode types) loads them at start-up instead,
+# e.g. so gunicorn --preload workers inherit them from the master process.
+PRELOAD_BACKENDS = os.environ.get("PRELOAD_BACKENDS")
+if PRELOAD_BACKENDS:
+    warm_up(None if PRELOAD_BACKENDS == "all" else PRELOAD_BACKENDS.split(","))
+
+# Set DOCUMENT_CACHE_DIR to keep the finished documents of repeatable
+# requests (manual SKUs, or random SKUs with a seed) for reprints, capped at
+# DOCUMENT_CACHE_MB. Those requests get an ETag either way.
+document_cache = DocumentCache(
+    os.environ.get("DOCUMENT_CACHE_DIR"),
+    int(os.environ.get("DOCUMENT_CACHE_MB", 512)) * 1024 * 1024,
+)
+
+job_queue = JobQueue(
+    workers=int(os.environ.get("JOB_WORKERS", 2)),
+    max_pending=int(os.environ.get("JOB_MAX_PENDING", 16)),
+    result_ttl=int(os.environ.get("JOB_RESULT_TTL", 3600)),
+    max_results=int(os.environ.get("JOB_MAX_RESULTS", 64)),
+    result_dir=os.environ.get("JOB_RESULT_DIR"),
+    # JOB_SHARD_WORKERS > 1 splits each job across that many processes
+    shard_workers=int(os.environ.get("JOB_SHARD_WORKERS", 1)),
+)
+
+# /generate requests are priced in estimated ms of rendering (see
+# admission.py). Up to ADMISSION_REQUEST_MS they share ADMISSION_GLOBAL_MS
+# of in-flight work; larger ones run in a slow lane of ADMISSION_SLOW_MS,
+# and over ADMISSION_MAX_MS they are refused. A request waits up to
+# ADMISSION_QUEUE_SECONDS for room before it gets a 429.
+admission = AdmissionController(
+    request_budget=float(os.environ.get("ADMISSION_REQUEST_MS", 20_000)),
+    global_budget=float(os.environ.get("ADMISSION_GLOBAL_MS", 60_000)),
+    slow_budget=float(os.environ.get("ADMISSION_SLOW_MS", 600_000)),
+    max_cost=float(os.environ.get("ADMISSION_MAX_MS", 1_800_000)),
+    queue_timeout=float(os.environ.get("ADMISSION_QUEUE_SECONDS", 10)),
+    max_waiting=int(os.environ.get("ADMISSION_MAX_WAITING", 32)),
+)
+
 @app.route('/previews/<path:filename>')
 def serve_previews(filename):
     return send_from_directory('previews', filename)
@@ -21,74 +77,218 @@ def index():
         return "<h1>Error: index.html not found</h1>", 500
 
 
+def request_data():
+    # JSON body, or a multipart form with the SKUs uploaded as sku_file
+    upload = request.files.get("sku_file")
+    if upload is None:
+        return request.get_json(), None
+
+    data = request.form.to_dict()
+    fmt = data.get("sku_format")
+    if not fmt:
+        is_csv = upload.filename.lower().endswith(".csv") or upload.mimetype == "text/csv"
+        fmt = "csv" if is_csv else "text"
+    sku_file = SkuFile(
+        upload.stream,
+        fmt=fmt,
+        column=data.get("csv_column") or None,
+        header=as_bool(data.get("csv_header", True)),
+    )
+    # the upload is closed with the request, so anything that reads it
+    # after the view returns works from a private copy
+    return data, sku_file
+
+
 @app.route("/generate", methods=["POST"])
 def generate():
-    data = request.get_json()
+    data, sku_file = request_data()
+    stream = as_bool(data.get("stream", False))
+    if stream and sku_file is not None:
+        sku_file = sku_file.spool()
+    options = label_options(data, sku_file)
+    report = validation_report(options)
+    if report["error_count"]:
+        return report, 422
+    options["validate"] = False
+    seed = seed_option(data, options)
+    key = document_key(options, seed, sku_index)
+    timer = options["timer"] = StageTimer() if TIMING_ENABLED else None
+    options["sku_index"] = sku_index
 
-    barcode_type = data.get("barcode_type", "code128")
-    quantity = int(data.get("quantity", 1))
-    rng_length = int(data.get("rng_length", 6))
-    prefix = data.get("prefix", "")
-    suffix = data.get("suffix", "")
-    label_width = float(data.get("label_width", 4))
-    label_height = float(data.get("label_height", 6))
-    rows = int(data.get("rows", 1))
-    columns = int(data.get("columns", 1))
-    rng_charset = data.get("rng_charset", "digits")
-    repeat_skus = data.get("repeat_skus", False)
-    no_symbols = bool(data.get("no_symbols", False))
-    layout_mode = data.get("layout_mode", "stacked")
-    text_size = int(data.get("text_size", 14))
-    barcode_size = int(data.get("barcode_size", 150))
-    layout_reversed = bool(data.get("layout_reversed", False))
-    dpi = int(data.get("dpi", 300))
-    raw_skus = data.get("sku_list", "")
-    if isinstance(raw_skus, list):
-        sku_list = raw_skus
+    mimetype, extension = OUTPUT_FORMATS[options["output_format"]]
+    headers = {"Content-Disposition": f"attachment; filename=labels.{extension}"}
+    if key:
+        # the same request always gives the same labels; weak, since a
+        # fresh render differs in its timestamps
+        headers["ETag"] = f'W/"{key}"'
+        if request.if_none_match.contains_weak(key):
+            document_cache.record_not_modified()
+            return Response(status=304, headers={"ETag": headers["ETag"]})
+        cached = document_cache.open(key)
+        if cached is not None:
+            headers["Content-Length"] = str(os.fstat(cached.fileno()).st_size)
+            return Response(send_open_file(cached), mimetype=mimetype, headers=headers)
+
+    try:
+        ticket = admission.admit(estimate_cost(options))
+    except AdmissionRejected as e:
+        if sku_file is not None:
+            sku_file.close()
+        return e.response()
+
+    if stream:
+        # pages go out as they are rendered; nothing is written to disk.
+        # The budget is held until the response is closed.
+        response = Response(stream_labels(**options), mimetype=mimetype, headers=headers)
+        response.call_on_close(ticket.release)
+        return response
+
+    cache_result = key and document_cache.directory
+    if cache_result:
+        output_path = document_cache.temp_path(f".{extension}")
     else:
-        sku_list = re.split(r"[,\s]+", raw_skus.strip())
-        sku_list = [sku for sku in sku_list if sku]
-    sku_list_raw = data.get("sku_list", "")
-    use_manual_preview = parse_sku_list(sku_list_raw)
-    x_offset = float(data.get("x_offset", 0))
-    y_offset = float(data.get("y_offset", 0))
-    truncate_templates = data.get("truncate_templates", [])
-
-    use_manual_preview = data.get("use_manual_preview", False)
-    if isinstance(use_manual_preview, str):
-        use_manual_preview = use_manual_preview.lower() == "true"
-
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-        output_path = tmp_file.name
-
-    generate_labels(
-        barcode_type=barcode_type,
-        quantity=quantity,
-        rng_length=rng_length,
-        prefix=prefix,
-        suffix=suffix,
-        output_path=output_path,
-        label_width=label_width,
-        label_height=label_height,
-        rows=rows,
-        columns=columns,
-        rng_charset=rng_charset,
-        repeat_skus=repeat_skus,
-        no_symbols=no_symbols,
-        layout_mode=layout_mode,
-        text_size=text_size,
-        barcode_size=barcode_size,
-        layout_reversed=layout_reversed,
-        dpi=dpi,
-        sku_list = sku_list,
-        use_manual_preview=use_manual_preview,
-        x_offset=x_offset,
-        y_offset=y_offset,
-        truncate_templates=truncate_templates
-    )
+        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{extension}") as tmp_file:
+            output_path = tmp_file.name
+
+    try:
+        with ticket:
+            generate_labels(output_path=output_path, **options)
+    except Exception:
+        os.remove(output_path)
+        raise
+    headers["Content-Length"] = str(os.path.getsize(output_path))
+    if timer:
+        headers["Server-Timing"] = timer.server_timing()
+    if cache_result:
+        # opened before it is handed over, in case it's evicted right away
+        document = open(output_path, "rb")
+        document_cache.put(key, output_path)
+        return Response(send_open_file(document), mimetype=mimetype, headers=headers)
+    return Response(send_and_remove(output_path), mimetype=mimetype, headers=headers)
+
+
+def validation_report(options):
+    # every bad manual SKU in one response, before anything is rendered
+    errors, error_count = manual_sku_errors(options)
+    rng_error = rng_sku_error(options)
+    if rng_error:
+        errors.append({"row": None, "sku": "", "error": rng_error})
+        error_count += 1
+    return {"valid": not error_count, "error_count": error_count, "errors": errors}
+
+
+@app.route("/validate", methods=["POST"])
+def validate():
+    data, sku_file = request_data()
+    return validation_report(label_options(data, sku_file))
+
+
+def send_open_file(f, chunk_size=64 * 1024):
+    with f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def send_and_remove(path, chunk_size=64 * 1024):
+    # send_file responses skip close callbacks, so the temp file is
+    # streamed from here and removed once sent (or the client goes away)
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+@app.route("/preview", methods=["POST"])
+def preview():
+    data = request.get_json()
+    width_px = min(max(int(data.get("preview_width", PREVIEW_WIDTH_PX)), 64), 1600)
+    # checked and priced like /generate, for the one page that is drawn
+    options = preview_options(label_options(data))
+    report = validation_report(options)
+    if report["error_count"]:
+        return report, 422
+    options["validate"] = False
+    try:
+        ticket = admission.admit(estimate_cost(options))
+    except AdmissionRejected as e:
+        return e.response()
+    with ticket:
+        png = render_preview(options, width_px)
+    return Response(png, mimetype="image/png")
+
+
+COUNTERS = ("hits", "disk_hits", "misses", "not_modified", "evictions",
+            "admitted", "queued", "rejected", "too_large", "wait_seconds")
+
+
+@app.route("/metrics")
+def metrics():
+    lines = [stage_metrics.prometheus()]
+    for cache_name, stats in (
+        ("barcode_cache", barcode_cache.stats()),
+        ("document_cache", document_cache.stats()),
+        ("admission", admission.stats()),
+    ):
+        for name, value in stats.items():
+            kind = "counter" if name in COUNTERS else "gauge"
+            metric = f"{cache_name}_{name}_total" if kind == "counter" else f"{cache_name}_{name}"
+            lines.append(f"# TYPE {metric} {kind}\n{metric} {value}\n")
+    return Response("".join(lines), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    data, sku_file = request_data()
+    if sku_file is not None:
+        sku_file = sku_file.spool()
+    options = label_options(data, sku_file)
+    report = validation_report(options)
+    if report["error_count"]:
+        if sku_file is not None:
+            sku_file.close()
+        return report, 422
+    options["validate"] = False
+    try:
+        # jobs have their own bounded queue; only refuse what's too large
+        admission.check_size(estimate_cost(options))
+    except AdmissionRejected as e:
+        if sku_file is not None:
+            sku_file.close()
+        return e.response()
+    seed_option(data, options)
+    options["timer"] = StageTimer() if TIMING_ENABLED else None
+    options["sku_index"] = sku_index
+    try:
+        job_id = job_queue.submit(options)
+    except JobQueueFull as e:
+        if sku_file is not None:
+            sku_file.close()
+        return {"error": str(e)}, 429, {"Retry-After": "30"}
+    return {"job_id": job_id, "status_url": f"jobs/{job_id}"}, 202
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return {"error": "unknown or expired job"}, 404
+    if status["state"] == "done":
+        status["download_url"] = f"jobs/{job_id}/download"
+    return status
+
 
-    return send_file(output_path, as_attachment=True, download_name="labels.pdf")
+@app.route("/jobs/<job_id>/download")
+def job_download(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return {"error": "unknown or expired job"}, 404
+    path = job_queue.result_path(job_id)
+    if path is None:
+        return {"error": f"job is {status['state']}"}, 409
+    mimetype, extension = OUTPUT_FORMATS[status["output_format"]]
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=f"labels.{extension}")
 
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 from flask import Flask
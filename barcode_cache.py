@@ -0,0 +1,144 @@
+from collections import OrderedDict
+from disk_lru import LruDirectory
+
+import hashlib
+import os
+import tempfile
+import threading
+
+
+# Barcode images keyed on (barcode_type, data, dpi, target_px, layout_mode).
+# Fields that do not change the image are passed as None so that, for
+# example, the same raw treepoem bitmap is shared by every layout.
+#
+# Images handed out by the cache are shared between callers and requests,
+# so they must be treated as read-only (convert/resize return copies).
+#
+# The in-memory tier holds at most max_items images and max_bytes of pixel
+# data: a stacked 2D symbol at a large target size is megabytes on its own.
+
+def image_bytes(img):
+    # pixel data held in memory by a PIL image (mode "1" is a byte per pixel)
+    return img.width * img.height * len(img.getbands())
+
+
+class BarcodeCache:
+    def __init__(self, max_items=2048, max_bytes=128 * 1024 * 1024, disk_dir=None, disk_max_bytes=256 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._disk = LruDirectory(disk_dir, ".png", disk_max_bytes) if disk_dir else None
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(barcode_type, data, dpi=None, target_px=None, layout_mode=None):
+        return (barcode_type, data, dpi, target_px, layout_mode)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._items:
+                return True
+        return self.disk_dir is not None and os.path.exists(self._disk_path(key))
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[0]
+
+        img = self._disk_get(key)
+        with self._lock:
+            if img is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, img)
+        return img
+
+    def put(self, key, img):
+        with self._lock:
+            self._remember(key, img)
+        self._disk_put(key, img)
+
+    def get_or_create(self, key, factory):
+        img = self.get(key)
+        if img is None:
+            img = factory()
+            if img is not None:
+                self.put(key, img)
+        return img
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "items": len(self._items),
+                "bytes": self._bytes,
+                "disk_bytes": self._disk.bytes if self._disk else 0,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def _remember(self, key, img):
+        size = image_bytes(img)
+        old = self._items.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        if size > self.max_bytes:
+            return  # would push out everything else
+        self._items[key] = (img, size)
+        self._bytes += size
+        while len(self._items) > self.max_items or self._bytes > self.max_bytes:
+            _, (_, evicted_size) = self._items.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def _disk_path(self, key):
+        return self._disk.path(hashlib.sha256(repr(key).encode("utf-8")).hexdigest())
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            from PIL import Image
+            with Image.open(path) as img:
+                img.load()
+                self._disk.touch(path)
+                return img.copy()
+        except (FileNotFoundError, OSError):
+            return None
+
+    def _disk_put(self, key, img):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                img.save(f, format="PNG")
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self.evictions += self._disk.added(size)
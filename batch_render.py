@@ -0,0 +1,247 @@
+from binascii import hexlify
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from math import ceil
+from textwrap import TextWrapper, indent
+
+from PIL import Image
+
+import io
+import shutil
+import struct
+import subprocess
+import sys
+import treepoem
+from treepoem import TreepoemError
+
+
+# One Ghostscript session per chunk of jobs instead of two per barcode.
+# Both passes mirror treepoem.generate_barcode: a bbox pass to measure each
+# symbol, then a png16m pass that renders every symbol onto its own page.
+
+PAGE_OFFSET = 3000
+JOB_MARKER = "TREEPOEM-JOB"
+
+BBOX_PROLOG = """\
+%!PS
+
+{bwipp}
+"""
+
+BBOX_JOB = """\
+(%stderr) (w) file dup (\\n{marker} {index}\\n) writestring flushfile
+userdict /tp_dicts countdictstack put
+mark {{
+  /Helvetica findfont 10 scalefont setfont
+  0 0 moveto
+  {data_options_encoder}
+  /uk.co.terryburton.bwipp findresource exec
+  showpage
+}} stopped {{
+  $error /errorname get dup length string cvs 0 6 getinterval (bwipp.) ne {{
+    stop
+  }} if
+  (%stderr) (w) file
+  dup (\\nBWIPP ERROR: ) writestring
+  dup $error /errorname get dup length string cvs writestring
+  dup ( ) writestring
+  dup $error /errorinfo get dup length string cvs writestring
+  dup (\\n) writestring
+  dup flushfile
+}} if
+cleartomark
+{{ countdictstack userdict /tp_dicts get le {{ exit }} if end }} loop
+"""
+
+RENDER_PROLOG = """\
+%!PS-Adobe-3.0
+%%LanguageLevel: 2
+%%EndComments
+%%BeginProlog
+{bwipp}
+%%EndProlog
+"""
+
+RENDER_JOB = """\
+<< /PageSize [{width} {height}] >> setpagedevice
+/Helvetica findfont 10 scalefont setfont
+{translate_x} {translate_y} moveto
+{data_options_encoder} /uk.co.terryburton.bwipp findresource exec
+showpage
+"""
+
+
+def _creationflags():
+    # Prevent GhostScript popup windows on Windows
+    return getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+
+# The helpers below are copied from treepoem 3.29 (where they are private),
+# so a treepoem upgrade can't change or remove them under us.
+
+@cache
+def ghostscript_binary():
+    if sys.platform.startswith("win"):
+        options = ("gswin32c", "gswin64c", "gs")
+    else:
+        options = ("gs",)
+    for name in options:
+        if shutil.which(name) is not None:
+            return name
+    raise TreepoemError("Cannot determine path to ghostscript, is it installed?")
+
+
+def _hexify(data):
+    # BWIPP's safe argument passing: data as a hex string
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return TextWrapper(subsequent_indent=" ", width=72).fill(f"<{hexlify(data).decode('ascii')}>")
+
+
+def _format_options(options):
+    items = []
+    for name, value in options.items():
+        if isinstance(value, bool):
+            if value:
+                items.append(name)
+        else:
+            items.append(f"{name}={value}")
+    return " ".join(items)
+
+
+def _encoder(job):
+    barcode_type, data, options = job
+    if barcode_type not in treepoem.barcode_types:
+        raise NotImplementedError(f"unsupported barcode type {barcode_type!r}")
+    return f"{_hexify(data)}\n{_hexify(_format_options(options or {}))}\n{_hexify(barcode_type)} cvn"
+
+
+def _measure(bwipp, encoders):
+    parts = [BBOX_PROLOG.format(bwipp=bwipp)]
+    for index, encoder in enumerate(encoders):
+        parts.append(BBOX_JOB.format(
+            marker=JOB_MARKER,
+            index=index,
+            data_options_encoder=indent(encoder, "  "),
+        ))
+
+    gs_process = subprocess.run(
+        [
+            ghostscript_binary(),
+            "-dSAFER",
+            "-dQUIET",
+            "-dNOPAUSE",
+            "-dBATCH",
+            "-sDEVICE=bbox",
+            "-c",
+            f"<</PageOffset [{PAGE_OFFSET} {PAGE_OFFSET}]>> setpagedevice",
+            "-f",
+            "-",
+        ],
+        text=True,
+        capture_output=True,
+        input="".join(parts),
+        creationflags=_creationflags(),
+    )
+    if gs_process.returncode != 0:
+        raise TreepoemError(gs_process.stderr.strip())
+
+    boxes = [None] * len(encoders)
+    errors = {}
+    current = None
+    for line in gs_process.stderr.splitlines():
+        if line.startswith(JOB_MARKER):
+            current = int(line.split()[1])
+        elif current is None:
+            continue
+        elif line.startswith("BWIPP ERROR: "):
+            errors[current] = line[len("BWIPP ERROR: "):]
+        elif line.startswith("%%HiResBoundingBox: "):
+            boxes[current] = tuple(float(n) for n in line.split()[1:5])
+
+    for index, box in enumerate(boxes):
+        if index in errors:
+            raise TreepoemError(errors[index])
+        if box is None:
+            raise TreepoemError(f"no bounding box reported for batch job {index}")
+    return boxes
+
+
+def _split_png_stream(stream):
+    signature = b"\x89PNG\r\n\x1a\n"
+    images = []
+    pos = 0
+    while pos < len(stream):
+        if stream[pos:pos + 8] != signature:
+            raise TreepoemError("unexpected data in Ghostscript PNG output")
+        end = pos + 8
+        while True:
+            length, chunk_type = struct.unpack(">I4s", stream[end:end + 8])
+            end += 12 + length
+            if chunk_type == b"IEND":
+                break
+        images.append(Image.open(io.BytesIO(stream[pos:end])))
+        pos = end
+    return images
+
+
+def _render_chunk(jobs, scale):
+    bwipp = treepoem.load_bwipp()
+    encoders = [_encoder(job) for job in jobs]
+    boxes = _measure(bwipp, encoders)
+
+    parts = [RENDER_PROLOG.format(bwipp=bwipp)]
+    for encoder, (bbx1, bby1, bbx2, bby2) in zip(encoders, boxes):
+        parts.append(RENDER_JOB.format(
+            width=bbx2 - bbx1,
+            height=bby2 - bby1,
+            translate_x=PAGE_OFFSET - bbx1,
+            translate_y=PAGE_OFFSET - bby1,
+            data_options_encoder=encoder,
+        ))
+
+    gs_process = subprocess.run(
+        [
+            ghostscript_binary(),
+            "-dSAFER",
+            "-dQUIET",
+            "-dNOPAUSE",
+            "-dBATCH",
+            "-sDEVICE=png16m",
+            f"-r{72 * scale}",
+            "-dTextAlphaBits=4",
+            "-dGraphicsAlphaBits=1",
+            "-sOutputFile=-",
+            "-",
+        ],
+        capture_output=True,
+        input="".join(parts).encode(),
+        creationflags=_creationflags(),
+    )
+    if gs_process.returncode != 0:
+        raise TreepoemError(gs_process.stderr.decode(errors="replace").strip())
+
+    images = _split_png_stream(gs_process.stdout)
+    if len(images) != len(jobs):
+        raise TreepoemError(f"expected {len(jobs)} pages from Ghostscript, got {len(images)}")
+    return images
+
+
+def render_barcodes(jobs, scale=2, workers=1, chunk_size=None):
+    # jobs: list of (barcode_type, data, options) tuples, in the same form
+    # treepoem.generate_barcode takes. Returns PIL images in job order.
+    jobs = list(jobs)
+    if not jobs:
+        return []
+
+    workers = max(1, min(workers, len(jobs)))
+    if chunk_size is None:
+        chunk_size = ceil(len(jobs) / workers)
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+
+    if len(chunks) == 1:
+        return _render_chunk(chunks[0], scale)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda chunk: _render_chunk(chunk, scale), chunks)
+        return [img for chunk_images in results for img in chunk_images]
@@ -0,0 +1,319 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import product
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Reproducible generate_labels benchmarks.
+#
+#   python benchmark.py --out results.json
+#   python benchmark.py --quick --baseline results.json
+#   python benchmark.py --load-only --requests 200 --concurrency 8
+#   python benchmark.py --startup-only --import-budget-ms 150
+#
+# Every case runs in a fresh process with a cold barcode cache and a fixed
+# RNG seed, so peak RSS is per case and runs are comparable over time.
+
+LAYOUTS = ["stacked", "side_by_side", "barcodeonly", "textonly"]
+GRIDS = [(1, 1), (3, 2), (10, 4)]
+LABEL_COUNTS = [120, 1200]
+QUICK_GRIDS = [(3, 2)]
+QUICK_LABEL_COUNTS = [120]
+SEED = 1234
+
+# SKU lengths the fixed-length symbologies accept (check digit added)
+RNG_LENGTHS = {"ean13": 12, "ean8": 7, "upca": 11, "upce": 7}
+
+
+# Cold start: importing these must not load a symbology library (they are
+# imported on first use, see symbologies.py).
+STARTUP_MODULES = ["generator", "app"]
+BACKEND_LIBRARIES = ["qrcode", "pystrich", "treepoem", "batch_render"]
+STARTUP_RUNS = 5
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+except ImportError:
+    rss = None
+loaded = [name for name in {libraries!r} if name in sys.modules]
+print(json.dumps({{"seconds": seconds, "rss": rss, "loaded": loaded}}))
+"""
+
+
+def barcode_types():
+    from symbologies import barcode_types
+    return barcode_types()
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def run_case(case):
+    from generator import generate_labels
+
+    rows, columns = case["grid"]
+    quantity = max(1, case["labels"] // (rows * columns))
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    result = dict(case, labels=quantity * rows * columns)
+    try:
+        start = time.perf_counter()
+        generate_labels(
+            barcode_type=case["barcode_type"],
+            quantity=quantity,
+            rng_length=RNG_LENGTHS.get(case["barcode_type"], 8),
+            output_path=path,
+            rows=rows,
+            columns=columns,
+            layout_mode=case["layout_mode"],
+            render_mode=case["render_mode"],
+            rng=random.Random(SEED),
+        )
+        elapsed = time.perf_counter() - start
+        result.update(
+            seconds=round(elapsed, 4),
+            labels_per_sec=round(result["labels"] / elapsed, 2),
+            pdf_bytes=os.path.getsize(path),
+        )
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        os.remove(path)
+    result["peak_rss_kb"] = peak_rss_kb()
+    return result
+
+
+def measure_startup(modules, runs):
+    # import time (median of fresh interpreters) and RSS right after import
+    results = {}
+    for module in modules:
+        samples = []
+        for _ in range(runs):
+            out = subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT.format(module=module, libraries=BACKEND_LIBRARIES)],
+                capture_output=True, text=True, check=True, env=dict(os.environ, PRELOAD_BACKENDS=""),
+            ).stdout
+            samples.append(json.loads(out.splitlines()[-1]))
+        rss = samples[-1]["rss"]
+        results[module] = {
+            "import_ms": round(statistics.median(s["seconds"] for s in samples) * 1000, 1),
+            "rss_kb": rss // 1024 if rss is not None and sys.platform == "darwin" else rss,
+            "backends_loaded": samples[-1]["loaded"],
+        }
+        print(
+            f"startup: import {module}: {results[module]['import_ms']} ms, {results[module]['rss_kb']} KB"
+            + (f", loaded {', '.join(results[module]['backends_loaded'])}" if results[module]["backends_loaded"] else "")
+        )
+    return results
+
+
+def check_startup(startup, budget_ms):
+    # backends pulled in at import time, or an import over budget
+    failures = []
+    for module, result in startup.items():
+        if result["backends_loaded"]:
+            failures.append(f"import {module} loads {', '.join(result['backends_loaded'])}")
+        if budget_ms is not None and result["import_ms"] > budget_ms:
+            failures.append(f"import {module} {result['import_ms']} ms > {budget_ms} ms")
+    for name in failures:
+        print(f"{name:50} STARTUP BUDGET")
+    return failures
+
+
+def case_name(case):
+    rows, columns = case["grid"]
+    return f"{case['barcode_type']}/{case['layout_mode']}/{rows}x{columns}/{case['labels']}/{case['render_mode']}"
+
+
+def run_matrix(types, layouts, grids, counts, render_modes):
+    cases = [
+        dict(barcode_type=bt, layout_mode=lm, grid=grid, labels=n, render_mode=rm)
+        for bt, lm, grid, n, rm in product(types, layouts, grids, counts, render_modes)
+    ]
+    results = []
+    # one process per case: cold caches and a clean peak RSS
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as pool:
+        for case, result in zip(cases, pool.map(run_case, cases)):
+            results.append(result)
+            if "error" in result:
+                print(f"{case_name(case):50} ERROR {result['error']}")
+            else:
+                print(
+                    f"{case_name(case):50} {result['labels_per_sec']:9.1f} labels/s"
+                    f" {result['peak_rss_kb'] or 0:8d} KB {result['pdf_bytes']:10d} B"
+                )
+    return results
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def run_load(requests, concurrency, body):
+    # The Flask app on a local threaded server, hit by `concurrency` clients.
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from app import app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/generate"
+    payload = json.dumps(body).encode()
+
+    def one(_):
+        request = urllib.request.Request(url, payload, {"Content-Type": "application/json"})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+            ok = True
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(one, range(requests)))
+        wall = time.perf_counter() - start
+    finally:
+        server.shutdown()
+
+    latencies = [seconds for seconds, ok in samples if ok]
+    result = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "body": body,
+        "errors": requests - len(latencies),
+        "requests_per_sec": round(requests / wall, 2),
+        "peak_rss_kb": peak_rss_kb(),
+    }
+    if latencies:
+        result["p50_ms"] = round(percentile(latencies, 50) * 1000, 1)
+        result["p99_ms"] = round(percentile(latencies, 99) * 1000, 1)
+    print(
+        f"load: {requests} requests x{concurrency}: {result['requests_per_sec']} req/s,"
+        f" p50 {result.get('p50_ms')} ms, p99 {result.get('p99_ms')} ms, {result['errors']} errors"
+    )
+    return result
+
+
+def compare(results, baseline, tolerance):
+    # labels/sec per case against the baseline; returns the regressions
+    before = {case_name(r): r for r in baseline.get("cases", []) if "error" not in r}
+    regressions = []
+    for result in results.get("cases", []):
+        name = case_name(result)
+        if "error" in result or name not in before:
+            continue
+        ratio = result["labels_per_sec"] / before[name]["labels_per_sec"]
+        if ratio < 1 - tolerance:
+            regressions.append((name, ratio))
+        print(f"{name:50} {ratio:6.2f}x{'  REGRESSION' if ratio < 1 - tolerance else ''}")
+
+    startup, base_startup = results.get("startup", {}), baseline.get("startup", {})
+    for module in startup:
+        if module in base_startup:
+            ratio = base_startup[module]["import_ms"] / startup[module]["import_ms"]
+            name = f"import {module}"
+            if ratio < 1 - tolerance:
+                regressions.append((name, ratio))
+            print(f"{name:50} {ratio:6.2f}x{'  REGRESSION' if ratio < 1 - tolerance else ''}")
+
+    load, base_load = results.get("load"), baseline.get("load")
+    if load and base_load and "p99_ms" in load and "p99_ms" in base_load:
+        ratio = base_load["p99_ms"] / load["p99_ms"]
+        if ratio < 1 - tolerance:
+            regressions.append(("load p99", ratio))
+        print(f"{'load p99':50} {ratio:6.2f}x{'  REGRESSION' if ratio < 1 - tolerance else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark generate_labels and /generate.")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a JSON file from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown before a case counts as a regression")
+    parser.add_argument("--quick", action="store_true", help="one grid and one label count")
+    parser.add_argument("--types", nargs="+", help="barcode types (default: every symbology backend)")
+    parser.add_argument("--layouts", nargs="+", default=LAYOUTS)
+    parser.add_argument("--grids", nargs="+", help="grids as ROWSxCOLUMNS, e.g. 3x2")
+    parser.add_argument("--counts", nargs="+", type=int, help="labels per case")
+    parser.add_argument("--render-modes", nargs="+", default=["raster"])
+    parser.add_argument("--no-load", action="store_true", help="skip the concurrent /generate scenario")
+    parser.add_argument("--load-only", action="store_true", help="run only the concurrent /generate scenario")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--no-startup", action="store_true", help="skip the cold import measurement")
+    parser.add_argument("--startup-only", action="store_true", help="only measure cold imports")
+    parser.add_argument("--import-budget-ms", type=float, help="fail if importing a module takes longer")
+    args = parser.parse_args(argv)
+
+    grids = [tuple(int(n) for n in grid.split("x")) for grid in args.grids] if args.grids else None
+    results = {
+        "seed": SEED,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "cases": [],
+    }
+    failures = []
+    if not args.no_startup:
+        results["startup"] = measure_startup(STARTUP_MODULES, STARTUP_RUNS)
+        failures = check_startup(results["startup"], args.import_budget_ms)
+    if not args.load_only and not args.startup_only:
+        results["cases"] = run_matrix(
+            args.types or barcode_types(),
+            args.layouts,
+            grids or (QUICK_GRIDS if args.quick else GRIDS),
+            args.counts or (QUICK_LABEL_COUNTS if args.quick else LABEL_COUNTS),
+            args.render_modes,
+        )
+    if not args.no_load and not args.startup_only:
+        body = {"barcode_type": "qrcode", "quantity": 10, "rows": 3, "columns": 2, "layout_mode": "stacked"}
+        results["load"] = run_load(args.requests, args.concurrency, body)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
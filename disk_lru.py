@@ -0,0 +1,66 @@
+import os
+
+
+# A cache directory capped at max_bytes: once it grows past the cap, the
+# files used least recently (oldest mtime; readers touch() a file on every
+# hit) are removed. Shared by barcode_cache's disk tier and document_cache.
+# Not locked on its own; both caches call it under their own lock.
+
+class LruDirectory:
+    def __init__(self, directory, suffix, max_bytes):
+        self.directory = directory
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.bytes = sum(size for _, _, size in self.entries())
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}{self.suffix}")
+
+    def entries(self):
+        # (mtime, path, size) of every cache file
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, path, st.st_size))
+        return entries
+
+    @staticmethod
+    def touch(path):
+        # bump for LRU eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def added(self, size):
+        # size more bytes were written; returns how many files were evicted
+        self.bytes += size
+        if self.bytes > self.max_bytes:
+            return self.evict()
+        return 0
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, _, size in entries)
+        evicted = 0
+        # trim to 90% of the cap so we don't rescan on every write
+        for _, path, size in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        self.bytes = total
+        return evicted
@@ -0,0 +1,106 @@
+from disk_lru import LruDirectory
+from itertools import islice
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+
+# Finished label documents on disk, keyed by a hash of the request that
+# produced them, so a reprint of the same sheet is a file read instead of a
+# new render. Only repeatable requests have a key: manual SKU lists, or
+# random SKUs from an explicit seed. The key doubles as the ETag.
+#
+# Files are bumped on every hit and the least recently used are removed
+# once the directory grows past max_bytes (see disk_lru).
+
+# Bump when a change to the renderer alters the output of an old request,
+# so documents cached before it are not served again.
+DOCUMENT_FORMAT_VERSION = 1
+
+# options that don't change the document
+IGNORED_OPTIONS = {"sku_list", "rng", "timer", "sku_index", "validate"}
+
+
+def document_key(options, seed=None, sku_index=None):
+    # Content hash of everything that decides the output of
+    # generate_labels(**options), or None if it isn't repeatable.
+    manual = options.get("use_manual_preview") and options.get("sku_list")
+    if not manual and (seed is None or sku_index is not None):
+        # unseeded, or seeded but skipping SKUs issued by earlier runs
+        return None
+    fields = {name: value for name, value in options.items() if name not in IGNORED_OPTIONS}
+    if not manual:
+        fields["seed"] = seed
+    digest = hashlib.sha256(json.dumps([DOCUMENT_FORMAT_VERSION, fields], sort_keys=True, default=str).encode("utf-8"))
+    if manual:
+        # only the SKUs that get printed
+        total_labels = options["quantity"] * options.get("rows", 1) * options.get("columns", 1)
+        for sku in islice(options["sku_list"], total_labels):
+            digest.update(sku.encode("utf-8") + b"\n")
+    return digest.hexdigest()
+
+
+class DocumentCache:
+    def __init__(self, directory=None, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self._files = LruDirectory(directory, ".doc", max_bytes) if directory else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def open(self, key):
+        # the cached document as an open binary file, or None; an open file
+        # can still be read after it is evicted
+        if not self.directory:
+            return None
+        path = self._files.path(key)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        self._files.touch(path)
+        with self._lock:
+            self.hits += 1
+        return f
+
+    def temp_path(self, suffix=""):
+        # a new file in the cache directory, so put() can move it in place
+        fd, path = tempfile.mkstemp(dir=self.directory, suffix=suffix + ".tmp")
+        os.close(fd)
+        return path
+
+    def put(self, key, path):
+        # moves the finished document at path into the cache
+        size = os.path.getsize(path)
+        target = self._files.path(key)
+        try:
+            size -= os.path.getsize(target)  # the same request rendered twice at once
+        except FileNotFoundError:
+            pass
+        os.replace(path, target)
+        with self._lock:
+            self.evictions += self._files.added(size)
+        return target
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "evictions": self.evictions,
+                "disk_bytes": self._files.bytes if self._files else 0,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
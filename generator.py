@@ -1,37 +1,40 @@
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import inch
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfbase.pdfmetrics import stringWidth
-from reportlab.pdfbase import pdfmetrics
-from PIL import Image
-from pystrich.datamatrix import DataMatrixEncoder
-
-import treepoem
+from barcode_cache import BarcodeCache
+from symbologies import make_barcode, make_scaled_qr, make_scaled_datamatrix, treepoem_job
+from concurrent.futures import ProcessPoolExecutor
+from pdf_images import ImageForms
+from pdf_stream import StreamingCanvas, stream_pdf
+from vector_barcodes import VECTOR_BARCODES, VECTOR_2D_BARCODES
+from vector_barcodes import encode_modules, qr_matrix, datamatrix_matrix
+from sku_sources import repeat_to
+from sku_validation import check_skus, find_sku_errors, with_check_digits
+from timing import stage_metrics
+from label_template import compile_template
+from text_layout import line_baselines, wrap_lines
+from printer_labels import OUTPUT_FORMATS, PRINTER_LABELS, uses_raster
+from itertools import islice
+
+import os
 import random
 import string
-import qrcode
 import re
 
-zint_map = {
-    "code39": 1,
-    "upce": 9,
-    "interleaved2of5": 6,
-    "datamatrix": 50,
-    "ean13": 13,
-    "ean8": 14,
-    "upca": 34,
-    }
+BATCH_RENDER_SIZE = 256
+BATCH_RENDER_WORKERS = 2
 
+# Worker processes for barcode rendering; 1 renders in the request process.
+# Jobs smaller than PARALLEL_MIN_LABELS always render serially.
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 1))
+PARALLEL_MIN_LABELS = 500
 
-SCALE_HEIGHT_BARCODES = {
-    "interleaved2of5", 
-    "code39", 
-    "upce", 
-    "upca", 
-    "ean13", 
-    "ean8", 
-    "code128"
-    }
+# Shared across requests; set BARCODE_CACHE_DIR to add the on-disk tier.
+barcode_cache = BarcodeCache(
+    max_items=int(os.environ.get("BARCODE_CACHE_ITEMS", 2048)),
+    max_bytes=int(os.environ.get("BARCODE_CACHE_MB", 128)) * 1024 * 1024,
+    disk_dir=os.environ.get("BARCODE_CACHE_DIR"),
+    disk_max_bytes=int(os.environ.get("BARCODE_CACHE_DISK_MB", 256)) * 1024 * 1024,
+)
 
 
 
@@ -54,6 +57,102 @@ def get_charset_pool(charset, no_symbols=False):
         pool = ''.join(c for c in pool if c.isalnum())
     return pool
 
+def unique_sku_space(rng_length, charset="digits", no_symbols=False, barcode_type=None):
+    # how many different random SKUs generate_rng_skus can draw
+    if barcode_type == "upce":
+        return 2 * 10 ** max(rng_length - 1, 0)
+    return len(get_charset_pool(charset, no_symbols)) ** rng_length
+
+
+def unique_sku_error(count, rng_length, charset="digits", no_symbols=False, barcode_type=None):
+    # why count unique random SKUs can't be drawn, or None
+    possible = unique_sku_space(rng_length, charset, no_symbols, barcode_type)
+    if count > possible:
+        return f"Only {possible} unique SKUs of length {rng_length} exist; {count} were requested."
+    return None
+
+RNG_BATCH_SIZE = 4096
+
+RNG_MAX_STALLED_DRAWS = 50
+
+def generate_rng_skus(count, rng_length, charset="digits", no_symbols=False,
+                      barcode_type=None, unique=False, rng=None, claim=None):
+    # Yields count random SKUs, drawn RNG_BATCH_SIZE at a time with one
+    # choices() call per batch from a pool built once. rng may be a seeded
+    # random.Random or random.SystemRandom() for a cryptographic source.
+    # unique=True never repeats a SKU within the run: duplicates are dropped
+    # and only that many are drawn again; a run that needs more than half of
+    # all possible SKUs samples them without replacement instead. claim(skus),
+    # if given, returns the SKUs that may be used (see
+    # sku_index.IssuedSkuIndex); the rest are redrawn the same way, giving up
+    # once RNG_MAX_STALLED_DRAWS draws in a row find none.
+    rng = rng or random
+    upce = barcode_type == "upce"
+    if upce:
+        # UPC-E number system digit is 0 or 1
+        pool, length = string.digits, rng_length - 1
+    else:
+        pool, length = get_charset_pool(charset, no_symbols), rng_length
+
+    if unique:
+        error = unique_sku_error(count, rng_length, charset, no_symbols, barcode_type)
+        if error:
+            raise ValueError(error)
+        seen = set()
+
+    def sku_at(index):
+        # the index-th SKU of the space, counting in base len(pool)
+        chars = []
+        for _ in range(length):
+            index, digit = divmod(index, len(pool))
+            chars.append(pool[digit])
+        sku = ''.join(reversed(chars))
+        return "01"[index] + sku if upce else sku
+
+    if unique and not claim:
+        possible = unique_sku_space(rng_length, charset, no_symbols, barcode_type)
+        if count * 2 > possible:
+            # redrawing collisions would crawl near the end of the space
+            for index in rng.sample(range(possible), count):
+                yield sku_at(index)
+            return
+
+    def draw(n):
+        chars = ''.join(rng.choices(pool, k=n * length))
+        skus = [chars[i:i + length] for i in range(0, n * length, length)] if length else [""] * n
+        if upce:
+            skus = [first + rest for first, rest in zip(rng.choices("01", k=n), skus)]
+        return skus
+
+    remaining = count
+    while remaining:
+        n = min(remaining, RNG_BATCH_SIZE)
+        batch = draw(n)
+        if unique or claim:
+            fresh = []
+            stalled = 0
+            while True:
+                if unique:
+                    candidates = []
+                    for sku in batch:
+                        if sku not in seen:
+                            seen.add(sku)
+                            candidates.append(sku)
+                    batch = candidates
+                if claim:
+                    batch = claim(batch)
+                fresh += batch
+                if len(fresh) == n:
+                    break
+                stalled = 0 if batch else stalled + 1
+                if claim and stalled == RNG_MAX_STALLED_DRAWS:
+                    raise ValueError(f"Could not find {n - len(fresh)} more unused SKUs of length {rng_length}; the SKU space is nearly used up.")
+                batch = draw(n - len(fresh))
+            batch = fresh
+        yield from batch
+        remaining -= n
+
+
 def truncate_sku(sku: str, side_len: int) -> str:
     if side_len == 0 or len(sku) <= side_len * 2:
         return sku
@@ -73,6 +172,30 @@ def parse_sku_list(sku_raw) -> list[str]:
         return []
 
 
+def render_images(keys, batch_workers=1):
+    # Builds the raw symbols for a list of barcode cache keys, in order. Runs
+    # in the request process or in a render pool worker; every treepoem
+    # symbol in the list is rendered in a single Ghostscript batch.
+    batch = [key for key in keys if treepoem_job(key[1], key[0])]
+    jobs = [treepoem_job(data, barcode_type) for barcode_type, data, *_ in batch]
+    raw = {}
+    if jobs:
+        from batch_render import render_barcodes
+        raw = dict(zip(batch, render_barcodes(jobs, workers=batch_workers)))
+
+    return [make_barcode(key[1], key[0], raw.get(key)) for key in keys]
+
+
+_render_pools = {}
+
+def get_render_pool(workers):
+    # Long-lived so worker start-up and imports are paid once per server.
+    pool = _render_pools.get(workers)
+    if pool is None:
+        pool = _render_pools[workers] = ProcessPoolExecutor(max_workers=workers)
+    return pool
+
+
 def generate_labels(
     barcode_type: str,
     quantity: int,
@@ -97,6 +220,18 @@ def generate_labels(
     x_offset: int = 0,
     y_offset: int = 0,
     truncate_templates: list[int] = None,
+    render_workers: int = None,
+    render_mode: str = "raster",
+    streaming: bool = False,
+    progress = None,
+    rng = None,
+    timer = None,
+    unique_skus: bool = False,
+    sku_index = None,
+    output_format: str = "pdf",
+    fix_check_digits: bool = False,
+    validate: bool = True,
+    pages = None,
 ):
 
 
@@ -106,433 +241,349 @@ def generate_labels(
 
     page_width = label_width * inch
     page_height = label_height * inch
-    c = canvas.Canvas(output_path, pagesize=(page_width, page_height))
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
 
-    def should_scale_barcode_height(barcode_type: str) -> bool:
-        return barcode_type in SCALE_HEIGHT_BARCODES
+    labels_per_page = rows * columns
+    total_labels = quantity * labels_per_page
 
-    
-    def is_valid_barcode(sku: str, barcode_type: str) -> bool:
-        if barcode_type == "ean13":
-            return sku.isdigit() and len(sku) == 12  # 12 digits + checksum is auto-added
-        if barcode_type == "ean8":
-            return sku.isdigit() and len(sku) == 7   # 7 digits + checksum
-        if barcode_type == "upca":
-            return sku.isdigit() and len(sku) == 11
-        if barcode_type == "upce":
-            return sku.isdigit() and len(sku) == 7
-        return True
+    # pages=(first, stop): only those pages of the job (0-based, stop
+    # excluded), with the same SKUs they'd get in a full run; see sharding
+    first_page, stop_page = pages or (0, quantity)
+    if not 0 <= first_page < stop_page <= quantity:
+        raise ValueError(f"Page range {first_page}-{stop_page} is outside the job's {quantity} pages.")
+    if pages and sku_index is not None:
+        # skipped pages would claim their SKUs too
+        raise ValueError("A page range can't be rendered with sku_index.")
+    first_label = first_page * labels_per_page
+    shard_labels = (stop_page - first_page) * labels_per_page
+
+    # Anything that would stop the run is checked here, before the output
+    # is opened: a streamed response can't take back pages already sent.
+    manual = use_manual_preview and sku_list
+    if manual and validate:
+        # every row that will be printed
+        check_skus(
+            islice(sku_list, total_labels), barcode_type, prefix, suffix, fix_check_digits,
+            label_count=None if repeat_skus else total_labels,
+        )
+    if not manual and unique_skus:
+        error = unique_sku_error(total_labels, rng_length, rng_charset, no_symbols, barcode_type)
+        if error:
+            raise ValueError(error)
+    printer = output_format in PRINTER_LABELS
+    if printer:
+        # ZPL/EPL, or 1-bit PNG/TIFF pages: labels are written (and
+        # streamed) one by one, at dpi
+        c = PRINTER_LABELS[output_format](output_path, (page_width, page_height), dpi)
+    elif streaming:
+        # pages are written to output_path (a path or file object) as they finish
+        c = StreamingCanvas(output_path, pagesize=(page_width, page_height))
+    else:
+        c = canvas.Canvas(output_path, pagesize=(page_width, page_height))
+    image_forms = None if printer else ImageForms(c)  # one XObject per unique barcode image
+
+    # cell rectangles and draw positions, shared by every page (and cached
+    # across runs with the same layout settings)
+    template = compile_template(
+        page_width, page_height, rows, columns, layout_mode, barcode_type,
+        text_size, barcode_size, layout_reversed, x_offset, y_offset
+    )
+
+    if render_workers is None:
+        render_workers = RENDER_WORKERS
+
+    # Raw symbols for the labels of the current prefetch window, keyed like
+    # barcode_cache. Filled from draw_grid by collect_window(). Stacked
+    # QR/DataMatrix are not prefetched: built at their final size they can
+    # be megabytes each, so they are made one at a time as cells are drawn
+    # and kept only in the size-capped barcode_cache.
+    prerendered = {}
+    pending_windows = {}
+
+    def cached_image(key, build):
+        return barcode_cache.get_or_create(
+            key, lambda: prerendered[key] if key in prerendered else build()
+        )
 
+    def use_vector(barcode_type):
+        return render_mode == "vector" and (
+            barcode_type in VECTOR_BARCODES or barcode_type in VECTOR_2D_BARCODES
+        )
 
-    def draw_barcode(sku, barcode_type, dpi):
-        if barcode_type == "none":
+    def image_key(sku):
+        # cache key of the raw symbol a cell for this SKU draws, if any
+        layout = layout_mode.lower()
+        if layout == "textonly" or barcode_type == "none" or use_vector(barcode_type):
             return None
-
-        if barcode_type == "qrcode":
-           return qrcode.make(sku).get_image().convert("RGB")
-
-        if barcode_type == "code128":
-            return treepoem.generate_barcode(barcode_type="code128", data=sku).convert("1")
-
-        if barcode_type == "ean13":
-            return treepoem.generate_barcode(barcode_type="ean13", data=sku).convert("1")
-
-        if barcode_type == "ean8":
-            return treepoem.generate_barcode(barcode_type="ean8", data=sku).convert("1")
-
-        if barcode_type == "upca":
-            return treepoem.generate_barcode(barcode_type="upca", data=sku).convert("1")
-
-
-        if barcode_type in zint_map:
-            return treepoem.generate_barcode(
-                barcode_type=barcode_type,
-                data=sku,
-                options={"symbology": str(zint_map[barcode_type])},
-            ).convert("1")
-
-        if not is_valid_barcode(sku, barcode_type):
-            raise ValueError(f"Invalid input '{sku}' for barcode type '{barcode_type}'")
-
-
-        try:
-            img = treepoem.generate_barcode(barcode_type=barcode_type, data=sku)
-            return img.convert("RGB")
-        except Exception as e:
-            raise RuntimeError(f"Failed to generate barcode {barcode_type} for {sku}: {e}")
-
-    
-
-    def generate_scaled_qr(data, box_size=10, border=1):
-        qr = qrcode.QRCode(
-            version=None,  # automatically choose best fit
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=box_size,  # size of each box (in pixels)
-            border=border  # white space around edges
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white").convert("1")
-        return img
-
-    def generate_scaled_datamatrix(data, scale=10):
-        encoder = DataMatrixEncoder(data)
-        encoder.save("temp_dm.png")  # Save barcode as a temporary image
-
-        img = Image.open("temp_dm.png").convert("RGB")  # Read it as PIL image
-        width, height = img.size
-        img = img.resize((width * scale, height * scale), Image.NEAREST)
-        return img
-
-    def draw_stacked(x, y, cell_width, cell_height, sku, barcode_type, layout_reversed, text_size, suppress_text=False, display_text=None):
-        nonlocal c
-        spacing = 20
-        effective_text_size = text_size * 1.5
-        effective_barcode_size = barcode_size * 0.7
-        adjustment = 62 if layout_reversed else 0
-
-        if barcode_type in SCALE_HEIGHT_BARCODES:
-            block_start_y = y + (cell_height - (effective_text_size + spacing + effective_barcode_size)) / 1.7 + adjustment
+        if printer:
+            # only symbols the printer has no command for are sent as images
+            return barcode_cache.make_key(barcode_type, sku) if uses_raster(output_format, barcode_type) else None
+        if layout == "stacked" and barcode_type in ("qrcode", "datamatrix"):
+            return None
+        # the raw symbol doesn't depend on dpi or layout; it is scaled when drawn
+        return barcode_cache.make_key(barcode_type, sku)
+
+    def submit_window(start, skus, parallel):
+        keys = []
+        seen = set()
+        for sku in skus:
+            key = image_key(sku)
+            if key is None or key in seen or key in barcode_cache:
+                continue
+            seen.add(key)
+            keys.append(key)
+
+        futures = None
+        if parallel and keys:
+            pool = get_render_pool(render_workers)
+            chunk = -(-len(keys) // render_workers)
+            futures = [pool.submit(render_images, keys[i:i + chunk]) for i in range(0, len(keys), chunk)]
+        pending_windows[start] = (keys, futures)
+
+    def collect_window(start):
+        nonlocal prerendered
+        prerendered = {}  # the last window's images are in barcode_cache or done with
+        keys, futures = pending_windows.pop(start)
+        if futures is None:
+            images = render_images(keys, batch_workers=BATCH_RENDER_WORKERS)
         else:
-            block_start_y = y + (cell_height - (effective_text_size + spacing + effective_barcode_size)) / 2.1 + adjustment
-
-        dynamic_shift = 0.025 * (rows ** 1.2 + columns ** 1.2)
-        block_start_y -= dynamic_shift
+            images = [img for future in futures for img in future.result()]
+        prerendered = dict(zip(keys, images))
 
-        if barcode_type in ["qrcode", "datamatrix"]:
+    def draw_barcode(sku, barcode_type, dpi):
+        if barcode_type == "none":
+            return None
+        key = barcode_cache.make_key(barcode_type, sku)
+        return cached_image(key, lambda: make_barcode(sku, barcode_type))
+
+    def draw_symbol(sku, barcode_type, x, y, width, height):
+        if use_vector(barcode_type) and barcode_type in VECTOR_2D_BARCODES:
+            # QR: the symbol qrcode.make() gives draw_barcode. DataMatrix: encoded
+            # by pystrich (as stacked layouts are), cropped to the symbol; the
+            # raster path uses BWIPP, which may pick another symbol size for the
+            # same data, so the two decode alike but needn't look alike
             if barcode_type == "qrcode":
-                img = generate_scaled_qr(sku, box_size=10)
-                base_pts = 1.7
-            elif barcode_type == "datamatrix":
-                img = generate_scaled_datamatrix(sku)
-                base_pts = 1.6
-
-
-            density_scale = min(1.0, 10 / (rows * columns) ** 0.45)  # more rows/cols  smaller content
-            target_pts = barcode_size * base_pts * density_scale
-
-            target_px = int(target_pts * dpi / 72)
-            img = img.resize((target_px, target_px), Image.LANCZOS)
-            img_reader = ImageReader(img)
-
-            barcode_x = x + (cell_width - target_pts) / 2
-            density_shift = 1.1 * (rows ** 1.25 + columns ** 1.25)
-            barcode_y = y + (cell_height - target_pts) / 2.5 - density_shift
-
-            if layout_reversed:
-                barcode_y -= effective_text_size - 79 # this needs a better solution, but good for now
-
-            spacing = 4
-            if layout_reversed:
-                text_y = barcode_y - effective_text_size - spacing
+                build = lambda: qr_matrix(sku)
             else:
-                text_y = barcode_y + target_pts + spacing
-
-            c.drawImage(img_reader, barcode_x, barcode_y, width=target_pts, height=target_pts)
-
-            if not suppress_text:
-                c.setFont("Helvetica", effective_text_size)
-                c.drawCentredString(x + cell_width / 2, text_y, display_text if display_text is not None else sku)
-
-
-
-        else:
-            barcode = draw_barcode(sku, barcode_type, dpi)
-            if barcode:
-                img_reader = ImageReader(barcode)
-
-                is_grid = (rows * columns) > 1
-                density_factor = (rows * columns) ** 0.45 if is_grid else 1
-
-                if is_grid:
-                    base_scale = 0.035  # Doubled for multi-label grids
-                    height_scale = 0.012  # Slightly taller for visibility
-                else:
-                    base_scale = 0.0115  # Single-label size
-                    height_scale = 0.0037
-
-                draw_width = cell_width * base_scale * barcode_size
-                shrink_factor = 1 + 0.0015 * (density_factor - 1)  # starts at 1, grows slowly
-                draw_height = cell_height * height_scale * barcode_size / shrink_factor
-
-
-                # Push the block downward slightly as density increases
-                offset_factor = 2 + (density_factor * 0.35)
-                offset_x = x + (cell_width - draw_width) / 2
-                offset_y = y + (cell_height - draw_height) / offset_factor
-
-
-                c.drawImage(
-                    img_reader,
-                    offset_x,
-                    offset_y,
-                    width=draw_width,
-                    height=draw_height
-                )
-
-                # Draw the text label for 1D barcodes
-                if not suppress_text:
-                    text_y = offset_y + draw_height + 4 if not layout_reversed else offset_y - effective_text_size - 4
-                    c.setFont("Helvetica", effective_text_size)
-                    c.drawCentredString(x + cell_width / 2, text_y, display_text if display_text is not None else sku)
-
-
-    def draw_side_by_side(x, y, cell_width, cell_height, sku, barcode_type, layout_reversed, text_size, display_text, barcode_size):
-        spacing = 16
-        effective_text_size = text_size * 1.4
-
-        # Make barcode as big as possible in the cell
-        max_barcode_width = cell_width * 0.55  
-        max_barcode_height = cell_height * 0.95
-        width_pts = min(barcode_size, max_barcode_width)
-        height_pts = min(barcode_size, max_barcode_height)
-        if should_scale_barcode_height(barcode_type):
-            height_pts *= 0.2
-
-        # Vertical centering
-        center_y = y + cell_height / 2
-        barcode_y = center_y - height_pts / 2
-
-        # Compute maximum text width for wrapping
-        max_text_width = max(cell_width * 0.45, cell_width - width_pts - 3 * spacing)
-        max_text_height = height_pts
-        max_chars_per_line = max(1, int(max_text_width / (effective_text_size * 0.6)))
-        max_lines = 3
-
-        def wrap_text(text, font_name, font_size, max_width, max_lines, truncate=False):
-            lines = []
-            current_line = ""
-            for char in text:
-                test_line = current_line + char
-                if stringWidth(test_line, font_name, font_size) <= max_width:
-                    current_line = test_line
-                else:
-                    lines.append(current_line)
-                    current_line = char
-                    if len(lines) >= max_lines - 1:
-                        break
-            if current_line:
-                lines.append(current_line)
-            if truncate and len(lines) == max_lines:
-                final = lines[-1]
-                while stringWidth(final + "...", font_name, font_size) > max_width and final:
-                    final = final[:-1]
-                lines[-1] = final + "..."
-            return lines[:max_lines]
-
-        truncate_enabled = False
-        if isinstance(truncate_templates, list):
-            truncate_enabled = True
-        elif isinstance(truncate_templates, int):
-            truncate_enabled = truncate_templates > 0
-
-
-        def wrap_text_by_chars(text, max_chars_per_line, max_lines):
-            lines = []
-            for i in range(0, len(text), max_chars_per_line):
-                if len(lines) >= max_lines:
-                    break
-                lines.append(text[i:i+max_chars_per_line])
-            # Truncate last line with ellipsis if needed
-            if len(lines) == max_lines and len(text) > max_lines * max_chars_per_line:
-                last_line = lines[-1]
-                lines[-1] = (last_line[:-3] + "...") if len(last_line) > 3 else "..."
-            return lines
-
-        wrapped_lines = wrap_text_by_chars(display_text, max_chars_per_line, max_lines)
-
-        c.setFont("Helvetica", effective_text_size)
-        total_text_height = len(wrapped_lines) * effective_text_size * 1.1
-        start_y = center_y + total_text_height / 2 - effective_text_size
-
-        if not layout_reversed:
-            # Barcode on right, text on left
-            barcode_x = x + cell_width - width_pts - spacing
-            text_right = barcode_x - spacing  # right edge of text
-            for i, line in enumerate(wrapped_lines):
-                line_y = start_y - i * effective_text_size * 1.1
-                text_width = stringWidth(line, "Helvetica", effective_text_size)
-                c.drawString(text_right - text_width, line_y, line)
+                build = lambda: datamatrix_matrix(sku, quiet_zone=False)
+            image_forms.draw_matrix(("vector", barcode_type, sku), build, x, y, width, height)
+        elif use_vector(barcode_type):
+            image_forms.draw_modules(
+                ("vector", barcode_type, sku),
+                lambda: encode_modules(barcode_type, sku),
+                x, y, width, height
+            )
         else:
-            # Barcode on left, text on right
-            barcode_x = x + spacing
-            text_left = barcode_x + width_pts + spacing  # left edge of text
-            for i, line in enumerate(wrapped_lines):
-                line_y = start_y - i * effective_text_size * 1.1
-                c.drawString(text_left, line_y, line)
-
-        # Draw the barcode image
-        barcode = draw_barcode(sku, barcode_type, dpi)
-        if barcode:
-            img_reader = ImageReader(barcode)
-            c.drawImage(
-                img_reader,
-                barcode_x,
-                barcode_y,
-                width=width_pts,
-                height=height_pts
+            image_forms.draw(
+                barcode_cache.make_key(barcode_type, sku),
+                draw_barcode(sku, barcode_type, dpi),
+                x, y, width, height
             )
 
+    def generate_scaled_qr(data, target_px, box_size=10, border=1):
+        key = barcode_cache.make_key("qrcode", data, dpi, target_px, "stacked")
+        return cached_image(key, lambda: make_scaled_qr(data, target_px, box_size, border))
 
-    def draw_barcode_only(x, y, cell_width, cell_height, sku, barcode_type, barcode_size, include_debug_text=False):
-        barcode = draw_barcode(sku, barcode_type, dpi)
-        if barcode:
-            img_reader = ImageReader(barcode)
-            bt = barcode_type.lower()
-
-            # 2D barcodes
-            if bt == "qrcode":
-                base_scale = 0.0085
-                size = min(cell_width, cell_height) * base_scale * barcode_size
-                draw_width = draw_height = size
-            elif bt == "datamatrix":
-                base_scale = 0.0055
-                size = min(cell_width, cell_height) * base_scale * barcode_size
-                draw_width = draw_height = size
+    def generate_scaled_datamatrix(data, target_px, scale=10):
+        key = barcode_cache.make_key("datamatrix", data, dpi, target_px, "stacked")
+        return cached_image(key, lambda: make_scaled_datamatrix(data, target_px, scale))
+
+    def draw_stacked_2d(sku, x, y, target_pts):
+        # stacked QR/DataMatrix, built at its final size rather than scaled
+        if use_vector(barcode_type):
+            # module grid drawn straight into target_pts, independent of dpi
+            if barcode_type == "qrcode":
+                build = lambda: qr_matrix(sku, "L", border=1)
             else:
-                # 1D barcodes
-                base_scale = 0.0065
-                draw_width = cell_width * base_scale * barcode_size
-                draw_height = cell_height * 0.002 * barcode_size  # Shorter height by default
-
-            offset_x = x + (cell_width - draw_width) / 2
-            offset_y = y + (cell_height - draw_height) / 2.3
-
-            c.drawImage(
-                img_reader,
-                offset_x,
-                offset_y,
-                width=draw_width,
-                height=draw_height
+                build = lambda: datamatrix_matrix(sku)
+            image_forms.draw_matrix(
+                ("vector", barcode_type, sku, "stacked"), build,
+                x, y, target_pts, target_pts
             )
-
-            if include_debug_text:
-                c.setFont("Helvetica", 1)
-                c.setFillGray(0.8)
-                c.drawCentredString(x + cell_width / 2, y + cell_height / 2, sku)
-
-
-    def draw_text_only(x, y, cell_width, cell_height, display_text, text_size, layout_reversed, rows, columns, barcode_size):
-        # Calculate max size allowed based on cell height
-        max_text_size = cell_height * 0.5
-        effective_text_size = min(text_size, max_text_size) * 1.5
-
-        # Initial centered positions
-        center_x = x + cell_width / 2
-        center_y = y + cell_height / 2.2
-
-        # Adjust text position based on label density
-        shift = 0.35 * (rows ** 1.15 + columns ** 1.15)
-        if layout_reversed:
-            center_y -= shift
         else:
-            center_y += shift
-
-        # Draw text
-        c.setFont("Helvetica-Bold", effective_text_size)
-        c.drawCentredString(center_x, center_y, display_text)
-
-
-
-    def draw_label_cell(x, y, cell_width, cell_height, sku, barcode_type, layout_mode, layout_reversed, text_size, display_text, rows, columns, barcode_size):
-        layout = layout_mode.lower()
-        if layout == "stacked":
-            draw_stacked(x, y+20, cell_width, cell_height, sku, barcode_type, layout_reversed, text_size, display_text=display_text)
-        elif layout == "side_by_side":
-            draw_side_by_side(x, y, cell_width, cell_height, sku, barcode_type, layout_reversed, text_size, display_text, barcode_size)
-        elif layout == "barcodeonly":
-            draw_barcode_only(x, y, cell_width, cell_height, sku, barcode_type, barcode_size)
-        elif layout == "textonly":
-            draw_text_only(x, y, cell_width, cell_height, display_text, text_size, layout_reversed, rows, columns, barcode_size)
-
+            target_px = int(target_pts * dpi / 72)
+            if barcode_type == "qrcode":
+                img = generate_scaled_qr(sku, target_px, box_size=10)
+            else:
+                img = generate_scaled_datamatrix(sku, target_px)
+            img_key = barcode_cache.make_key(barcode_type, sku, dpi, target_px, "stacked")
+            image_forms.draw(img_key, img, x, y, width=target_pts, height=target_pts)
+
+    def draw_cell_text(text, display_text):
+        if text[0] == "centred":
+            _, text_x, text_y = text
+            c.drawCentredString(text_x, text_y, display_text)
+            return
+
+        # side_by_side: wrapped next to the barcode
+        _, edge_x, center_y, align, max_width, max_lines = text
+        font_name, font_size = template.font
+        wrapped_lines = wrap_lines(display_text, font_name, font_size, max_width, max_lines)
+        baselines = line_baselines(len(wrapped_lines), center_y, font_size)
+        for (line, line_width), line_y in zip(wrapped_lines, baselines):
+            if align == "right":
+                c.drawString(edge_x - line_width, line_y, line)
+            else:
+                c.drawString(edge_x, line_y, line)
+
+    def draw_cell(cell, sku, display_text):
+        if cell.text and cell.text_first:
+            draw_cell_text(cell.text, display_text)
+        if cell.symbol:
+            x, y, width, height = cell.symbol
+            if cell.stacked_2d:
+                draw_stacked_2d(sku, x, y, width)
+            else:
+                draw_symbol(sku, barcode_type, x, y, width=width, height=height)
+        if cell.text and not cell.text_first:
+            draw_cell_text(cell.text, display_text)
 
-        else:
-            raise ValueError(f"Unknown layout mode: {layout_mode}")
+    if printer:
+        def draw_cell(cell, sku, display_text):
+            c.draw_cell(cell, barcode_type, sku, display_text, lambda: draw_barcode(sku, barcode_type, dpi))
 
-    def draw_grid(skus):
-        cell_width = page_width / columns
-        cell_height = page_height / rows
+    def draw_grid(skus, count):
+        # skus is consumed lazily; only the current (and, when rendering in
+        # parallel, the next) prefetch window is held in memory.
         labels_per_page = rows * columns
-
-        for i in range(0, len(skus), labels_per_page):
-            page_skus = skus[i:i + labels_per_page]
-            index = 0
-            for r in range(rows):
-                for col in range(columns):
-                    if index >= len(page_skus):
-                        break
-                    x = col * cell_width + x_offset
-                    y = r * cell_height + y_offset - rows + columns
-                    raw_sku = page_skus[index]
-                    full_sku = f"{prefix}{raw_sku}{suffix}"
-                    if layout_mode.lower() == "side_by_side":
-                        display_text = f"{prefix}{raw_sku}{suffix}"
-                    elif truncate_templates and index < len(truncate_templates):
-                        trunc_len = truncate_templates[index]
-                        display_text = truncate_sku(f"{prefix}{raw_sku}{suffix}", trunc_len)
-                    else:
-                        display_text = f"{prefix}{raw_sku}{suffix}"
-
-
-                    draw_label_cell(
-                        x, y,
-                        cell_width, cell_height,
-                        full_sku,  # always pass the full SKU for barcode
-                        barcode_type, layout_mode, layout_reversed, text_size,
-                        display_text,  # pass the truncated or full text for the label
-                        rows, columns, barcode_size
-                    )
-                    index += 1
+        # Barcode images are rendered a window of whole pages at a time: in one
+        # Ghostscript batch, or fanned out to the render pool for big jobs.
+        window = -(-BATCH_RENDER_SIZE // labels_per_page) * labels_per_page
+        parallel = render_workers > 1 and count >= PARALLEL_MIN_LABELS
+        total_pages = -(-count // labels_per_page)
+        if progress:
+            progress(0, total_pages)
+
+        skus = iter(skus)
+        windows = {}
+
+        def window_skus(start):
+            if start not in windows:
+                windows[start] = list(islice(skus, window))
+            return [f"{prefix}{raw_sku}{suffix}" for raw_sku in windows[start]]
+
+        for i in range(0, count, labels_per_page):
+            if i % window == 0:
+                windows.pop(i - window, None)
+                if i not in pending_windows:
+                    submit_window(i, window_skus(i), parallel)
+                if parallel and i + window < count:
+                    # let the pool render the next window while we draw this one
+                    submit_window(i + window, window_skus(i + window), parallel)
+                collect_window(i)
+            offset = i % window
+            page_skus = windows[i - offset][offset:offset + labels_per_page]
+            if template.font:
+                # every cell's text uses the same font; set it once per page
+                c.setFont(*template.font)
+            for index, (cell, raw_sku) in enumerate(zip(template.cells, page_skus)):
+                full_sku = f"{prefix}{raw_sku}{suffix}"
+                if layout_mode.lower() == "side_by_side":
+                    display_text = full_sku
+                elif truncate_templates and index < len(truncate_templates):
+                    display_text = truncate_sku(full_sku, truncate_templates[index])
+                else:
+                    display_text = full_sku
+                # full SKU for the barcode, truncated or full text for the label
+                draw_cell(cell, full_sku, display_text)
             c.showPage()
+            if progress:
+                progress(i // labels_per_page + 1, total_pages)
 
 
 
 
-    def generate_rng_sku():
-        if barcode_type == "upce":
-            first = random.choice("01")
-            rest = ''.join(random.choices(string.digits, k=rng_length - 1))
-            return f"{first}{rest}"
-        pool = get_charset_pool(rng_charset, no_symbols)
-        core = ''.join(random.choices(pool, k=rng_length))
-        return core
-
-    label_count = quantity * rows * columns
-
-    if use_manual_preview and sku_list:
-        if len(sku_list) < label_count:
-            if repeat_skus:
-                times = (label_count + len(sku_list) - 1) // len(sku_list)
-                sku_list = (sku_list * times)[:label_count]
-            else:
-                raise ValueError("Manual SKU list is shorter than label count and repeat_skus is false.")
-        else:
-            sku_list = sku_list[:label_count]
-
-
-
-
-    labels_per_page = rows * columns
-    total_labels = quantity * labels_per_page
-
-    
-    # manual
-    if use_manual_preview and sku_list:
-        if len(sku_list) < total_labels:
-            if repeat_skus:
-                times = (total_labels + len(sku_list) - 1) // len(sku_list)
-                sku_list = (sku_list * times)[:total_labels]
-            else:
-                raise ValueError("Manual SKU list is shorter than label count and repeat_skus is false.")
-        else:
-            sku_list = sku_list[:total_labels]
-
-        draw_grid(sku_list)
+    # manual: a list, or a lazy source such as sku_sources.SkuFile
+    if manual:
+        skus = repeat_to(sku_list, total_labels, repeat_skus)
+        if fix_check_digits:
+            # the check digit goes after the suffix, so the SKUs carry
+            # prefix and suffix from here on
+            skus = with_check_digits(skus, barcode_type, prefix, suffix)
+            prefix = suffix = ""
 
     # rng
     else:
-        sku_list = [generate_rng_sku() for _ in range(total_labels)]
-        draw_grid(sku_list)
+        # a seeded random.Random as rng gives a repeatable run (e.g. previews)
+        claim = None
+        if sku_index is not None:
+            # sku_index.IssuedSkuIndex: skip SKUs issued by earlier runs
+            def claim(cores):
+                claimed = set(sku_index.claim([f"{prefix}{core}{suffix}" for core in cores]))
+                return [core for core in cores if f"{prefix}{core}{suffix}" in claimed]
+        skus = generate_rng_skus(
+            total_labels, rng_length, rng_charset, no_symbols, barcode_type, unique_skus, rng, claim
+        )
 
+    if first_label:
+        # earlier pages' SKUs are still drawn (a seeded rng is skipped by
+        # replaying it), just not rendered
+        skus = islice(skus, first_label, None)
+
+    if timer:
+        # timing.StageTimer: wrap the stages in place; untimed runs call
+        # the plain functions
+        skus = timer.timed_iter("skus", skus)
+        submit_window = timer.timed("render", submit_window)
+        collect_window = timer.timed("render", collect_window)
+        draw_barcode = timer.timed("image", draw_barcode)
+        generate_scaled_qr = timer.timed("image", generate_scaled_qr)
+        generate_scaled_datamatrix = timer.timed("image", generate_scaled_datamatrix)
+        if image_forms:
+            image_forms.draw = timer.timed("draw", image_forms.draw)
+            image_forms.draw_modules = timer.timed("draw", image_forms.draw_modules)
+            image_forms.draw_matrix = timer.timed("draw", image_forms.draw_matrix)
+        draw_cell = timer.timed("layout", draw_cell)
+        c.showPage = timer.timed("page", c.showPage)
+        c.save = timer.timed("save", c.save)
+
+    draw_grid(skus, shard_labels)
     c.save()
+
+    if timer:
+        stage_metrics.record(timer, barcode_type, layout_mode, shard_labels, stop_page - first_page)
     return output_path
+
+
+def rng_sku_error(options):
+    # why generate_labels(**options) can't draw its random SKUs, or None
+    if options.get("use_manual_preview") and options.get("sku_list") or not options.get("unique_skus"):
+        return None
+    total_labels = options["quantity"] * options.get("rows", 1) * options.get("columns", 1)
+    return unique_sku_error(
+        total_labels,
+        options["rng_length"],
+        options.get("rng_charset", "digits"),
+        options.get("no_symbols", False),
+        options["barcode_type"],
+    )
+
+
+def manual_sku_errors(options):
+    # (errors, error_count) for the manual SKUs generate_labels(**options)
+    # would print; see sku_validation.find_sku_errors
+    if not (options.get("use_manual_preview") and options.get("sku_list")):
+        return [], 0
+    total_labels = options["quantity"] * options.get("rows", 1) * options.get("columns", 1)
+    return find_sku_errors(
+        islice(options["sku_list"], total_labels),
+        options["barcode_type"],
+        options.get("prefix", ""),
+        options.get("suffix", ""),
+        options.get("fix_check_digits", False),
+        label_count=None if options.get("repeat_skus") else total_labels,
+    )
+
+
+def stream_labels(**kwargs):
+    # Same arguments as generate_labels (minus output_path); yields the PDF
+    # (or ZPL/EPL) in chunks while the pages are still being rendered.
+    return stream_pdf(lambda sink: generate_labels(output_path=sink, streaming=True, **kwargs))
+
+
+if __name__ == "__main__":
+    # python -m generator MANIFEST: see label_batch. It imports this module
+    # by name, so the batch shares one barcode_cache with everything else.
+    from label_batch import main
+    raise SystemExit(main())
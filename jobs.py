@@ -0,0 +1,137 @@
+from concurrent.futures import ThreadPoolExecutor
+from generator import generate_labels
+from printer_labels import OUTPUT_FORMATS
+from sharding import ProcessShardWorkers, render_sharded
+
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+
+# Background label runs for /jobs. Each job renders to its own PDF in
+# result_dir; finished results are kept for result_ttl seconds (and at most
+# max_results of them) and then deleted along with their status entry.
+# Without a result_dir, a temp directory is made on the first submit and
+# removed when the process exits.
+# With shard_workers > 1, jobs of several pages are split into that many
+# page ranges rendered by a shared pool of processes (see sharding).
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    def __init__(self, workers=2, max_pending=16, result_ttl=3600, max_results=64, result_dir=None,
+                 shard_workers=1):
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.max_results = max_results
+        self.result_dir = result_dir
+        self._own_result_dir = result_dir is None
+        if result_dir:
+            os.makedirs(result_dir, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="label-job")
+        self.shard_workers = shard_workers
+        self._shard_pool = ProcessShardWorkers(shard_workers) if shard_workers > 1 else None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, options):
+        self.expire()
+        with self._lock:
+            active = sum(job["state"] in ("queued", "running") for job in self._jobs.values())
+            if active >= self.max_pending:
+                raise JobQueueFull(f"{active} jobs already queued or running")
+            if self.result_dir is None:
+                self.result_dir = tempfile.mkdtemp(prefix="label-jobs-")
+                atexit.register(shutil.rmtree, self.result_dir, ignore_errors=True)
+            job_id = uuid.uuid4().hex
+            output_format = options.get("output_format", "pdf")
+            self._jobs[job_id] = {
+                "id": job_id,
+                "state": "queued",
+                "pages_done": 0,
+                "pages_total": None,
+                "error": None,
+                "output_format": output_format,
+                "path": os.path.join(self.result_dir, f"{job_id}.{OUTPUT_FORMATS[output_format][1]}"),
+                "submitted": time.time(),
+                "finished": None,
+            }
+        self._pool.submit(self._run, job_id, dict(options))
+        return job_id
+
+    def status(self, job_id):
+        self.expire()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {key: value for key, value in job.items() if key != "path"}
+
+    def result_path(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["state"] != "done":
+                return None
+            return job["path"]
+
+    def expire(self):
+        now = time.time()
+        with self._lock:
+            finished = sorted(
+                (job for job in self._jobs.values() if job["finished"] is not None),
+                key=lambda job: job["finished"],
+            )
+            overflow = len(finished) - self.max_results
+            expired = [
+                job for n, job in enumerate(finished)
+                if n < overflow or now - job["finished"] > self.result_ttl
+            ]
+            for job in expired:
+                del self._jobs[job["id"]]
+        for job in expired:
+            if os.path.exists(job["path"]):
+                os.remove(job["path"])
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+        if self._shard_pool:
+            self._shard_pool.shutdown()
+        if self._own_result_dir and self.result_dir:
+            shutil.rmtree(self.result_dir, ignore_errors=True)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _run(self, job_id, options):
+        path = self._jobs[job_id]["path"]
+        self._update(job_id, state="running")
+
+        def progress(pages_done, pages_total):
+            self._update(job_id, pages_done=pages_done, pages_total=pages_total)
+
+        # SKUs claimed from sku_index have to be drawn in one process
+        sharded = self._shard_pool and options.get("sku_index") is None and options["quantity"] > 1
+        try:
+            if sharded:
+                render_sharded(
+                    output_path=path, shards=self.shard_workers, workers=self._shard_pool, progress=progress, **options
+                )
+            else:
+                generate_labels(output_path=path, progress=progress, **options)
+        except Exception as e:
+            if os.path.exists(path):
+                os.remove(path)
+            self._update(job_id, state="failed", error=str(e), finished=time.time())
+        else:
+            self._update(job_id, state="done", finished=time.time())
+        finally:
+            close = getattr(options.get("sku_list"), "close", None)
+            if close:
+                close()  # a spooled SkuFile upload
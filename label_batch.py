@@ -0,0 +1,167 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from generator import barcode_cache, generate_labels
+from printer_labels import OUTPUT_FORMATS
+from request_options import as_bool, label_options, seed_option
+from sku_sources import SkuFile
+from symbologies import warm_up
+
+import argparse
+import json
+import os
+import sys
+import time
+
+
+# Many label jobs in one warm process, without the web server:
+#
+#   python -m generator nightly.jsonl --out-dir labels --workers 4
+#
+# Each manifest line is a JSON object with the parameters /generate takes,
+# plus optionally "name" (the output file name, default job-<line>) and
+# "sku_file" (a text or CSV file of SKUs, relative to the manifest, read
+# with sku_format, csv_column and csv_header as for uploads). Blank lines
+# and lines starting with # are skipped.
+#
+# Jobs share one thread pool, so symbology backends, BWIPP and the barcode
+# cache are loaded once and reused by every job. The manifest is read as
+# jobs are started, with at most twice the worker count queued.
+
+
+def read_manifest(f):
+    for line_number, line in enumerate(f, start=1):
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line_number, line
+
+
+def job_options(data, base_dir):
+    sku_file = None
+    if data.get("sku_file"):
+        path = os.path.join(base_dir, data["sku_file"])
+        fmt = data.get("sku_format") or ("csv" if path.lower().endswith(".csv") else "text")
+        sku_file = SkuFile(
+            open(path, "rb"),
+            fmt=fmt,
+            column=data.get("csv_column") or None,
+            header=as_bool(data.get("csv_header", True)),
+        )
+    options = label_options(data, sku_file)
+    seed_option(data, options)
+    return options
+
+
+def run_job(line_number, line, out_dir, base_dir):
+    result = {"line": line_number, "name": f"job-{line_number:04d}", "path": None,
+              "labels": 0, "pages": 0, "seconds": 0.0, "bytes": 0, "error": None}
+    started = time.perf_counter()
+    options = None
+    try:
+        data = json.loads(line)
+        if data.get("name"):
+            result["name"] = str(data["name"])
+            if os.path.basename(result["name"]) != result["name"]:
+                raise ValueError(f"Job name {result['name']!r} must be a plain file name")
+        options = job_options(data, base_dir)
+        extension = OUTPUT_FORMATS[options["output_format"]][1]
+        path = os.path.join(out_dir, f"{result['name']}.{extension}")
+        generate_labels(output_path=path, **options)
+        result.update(
+            path=path,
+            labels=options["quantity"] * options["rows"] * options["columns"],
+            pages=options["quantity"],
+            bytes=os.path.getsize(path),
+        )
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        result["seconds"] = time.perf_counter() - started
+        close = getattr(options and options.get("sku_list"), "close", None)
+        if close:
+            close()
+    return result
+
+
+def run_manifest(manifest, out_dir, workers=2, base_dir=".", on_result=None):
+    # results in manifest order; on_result(result) is called as each finishes
+    os.makedirs(out_dir, exist_ok=True)
+    results = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="label-batch") as pool:
+        pending = set()
+
+        def finish(done):
+            for future in done:
+                results.append(future.result())
+                if on_result:
+                    on_result(results[-1])
+
+        for line_number, line in read_manifest(manifest):
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                finish(done)
+            pending.add(pool.submit(run_job, line_number, line, out_dir, base_dir))
+        finish(wait(pending).done)
+    return sorted(results, key=lambda result: result["line"])
+
+
+def rate(labels, seconds):
+    return labels / seconds if seconds else 0.0
+
+
+def print_summary(results, wall_seconds, out=None):
+    out = out or sys.stdout
+    print(f"{'job':30} {'labels':>8} {'pages':>6} {'seconds':>8} {'labels/s':>9}  status", file=out)
+    for result in results:
+        status = "ok" if result["error"] is None else f"FAILED {result['error']}"
+        print(
+            f"{result['name'][:30]:30} {result['labels']:8d} {result['pages']:6d} "
+            f"{result['seconds']:8.2f} {rate(result['labels'], result['seconds']):9.1f}  {status}",
+            file=out,
+        )
+    labels = sum(result["labels"] for result in results)
+    failed = sum(result["error"] is not None for result in results)
+    job_seconds = sum(result["seconds"] for result in results)
+    print(
+        f"{len(results)} jobs, {failed} failed; {labels} labels in {wall_seconds:.2f}s "
+        f"({rate(labels, wall_seconds):.1f} labels/s, {job_seconds:.2f}s of job time)",
+        file=out,
+    )
+    cache = barcode_cache.stats()
+    print(
+        f"barcode cache: {cache['hits'] + cache['disk_hits']} hits, {cache['misses']} misses "
+        f"({cache['hit_rate']:.0%} hit rate)",
+        file=out,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m generator", description="Render a manifest of label jobs.")
+    parser.add_argument("manifest", help="JSONL file of /generate parameters, one job per line ('-' for stdin)")
+    parser.add_argument("--out-dir", default="labels", help="where to write the documents (default: labels)")
+    parser.add_argument("--workers", type=int, default=2, help="jobs rendered at once (default: 2)")
+    parser.add_argument("--preload", help="barcode types to load before the first job, comma-separated, or 'all'")
+    parser.add_argument("--summary", help="also write the per-job results as JSON to this file")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    if args.preload:
+        warm_up(None if args.preload == "all" else args.preload.split(","))
+
+    def on_result(result):
+        status = "ok" if result["error"] is None else "FAILED"
+        print(f"{result['name']}: {status} in {result['seconds']:.2f}s", file=sys.stderr)
+
+    started = time.perf_counter()
+    if args.manifest == "-":
+        results = run_manifest(sys.stdin, args.out_dir, args.workers, on_result=on_result)
+    else:
+        with open(args.manifest, encoding="utf-8") as manifest:
+            base_dir = os.path.dirname(os.path.abspath(args.manifest))
+            results = run_manifest(manifest, args.out_dir, args.workers, base_dir, on_result)
+    wall_seconds = time.perf_counter() - started
+
+    print_summary(results, wall_seconds)
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump({"wall_seconds": wall_seconds, "jobs": results}, f, indent=2)
+    return 1 if any(result["error"] is not None for result in results) else 0
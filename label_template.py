@@ -0,0 +1,205 @@
+from collections import namedtuple
+from functools import lru_cache
+
+
+# The geometry of a label page, worked out once per set of layout settings
+# instead of for every cell of every page. A template lists, for each cell
+# position on the page, where its symbol goes and where its text goes, in
+# absolute page coordinates; drawing a page is then just placing each SKU's
+# barcode and text at those spots.
+#
+# symbol: (x, y, width, height), or None when the cell has no barcode.
+# stacked_2d: the symbol is a stacked-layout QR/DataMatrix, which is built
+#   at its final size rather than scaled from the raw symbol.
+# text: ("centred", x, y), or ("wrapped", edge_x, center_y, align, max_width,
+#   max_lines) for side_by_side (see text_layout.wrap_lines), or None.
+# text_first: text is drawn before the symbol (matters where they overlap).
+
+CellPlan = namedtuple("CellPlan", "symbol stacked_2d text text_first")
+LabelTemplate = namedtuple("LabelTemplate", "cells font")
+
+SCALE_HEIGHT_BARCODES = {
+    "interleaved2of5",
+    "code39",
+    "upce",
+    "upca",
+    "ean13",
+    "ean8",
+    "code128"
+    }
+
+WRAPPED_MAX_LINES = 3
+
+
+def stacked_2d_target_pts(barcode_type, barcode_size, rows, columns):
+    base_pts = 1.7 if barcode_type == "qrcode" else 1.6
+    density_scale = min(1.0, 10 / (rows * columns) ** 0.45)  # more rows/cols  smaller content
+    return barcode_size * base_pts * density_scale
+
+
+def plan_stacked(x, y, cell_width, cell_height, barcode_type, layout_reversed, text_size, barcode_size, rows, columns):
+    effective_text_size = text_size * 1.5
+
+    if barcode_type in ["qrcode", "datamatrix"]:
+        target_pts = stacked_2d_target_pts(barcode_type, barcode_size, rows, columns)
+
+        barcode_x = x + (cell_width - target_pts) / 2
+        density_shift = 1.1 * (rows ** 1.25 + columns ** 1.25)
+        barcode_y = y + (cell_height - target_pts) / 2.5 - density_shift
+
+        if layout_reversed:
+            barcode_y -= effective_text_size - 79 # this needs a better solution, but good for now
+
+        spacing = 4
+        if layout_reversed:
+            text_y = barcode_y - effective_text_size - spacing
+        else:
+            text_y = barcode_y + target_pts + spacing
+
+        symbol = (barcode_x, barcode_y, target_pts, target_pts)
+        return CellPlan(symbol, True, ("centred", x + cell_width / 2, text_y), False)
+
+    if barcode_type == "none":
+        return CellPlan(None, False, None, False)
+
+    is_grid = (rows * columns) > 1
+    density_factor = (rows * columns) ** 0.45 if is_grid else 1
+
+    if is_grid:
+        base_scale = 0.035  # Doubled for multi-label grids
+        height_scale = 0.012  # Slightly taller for visibility
+    else:
+        base_scale = 0.0115  # Single-label size
+        height_scale = 0.0037
+
+    draw_width = cell_width * base_scale * barcode_size
+    shrink_factor = 1 + 0.0015 * (density_factor - 1)  # starts at 1, grows slowly
+    draw_height = cell_height * height_scale * barcode_size / shrink_factor
+
+    # Push the block downward slightly as density increases
+    offset_factor = 2 + (density_factor * 0.35)
+    offset_x = x + (cell_width - draw_width) / 2
+    offset_y = y + (cell_height - draw_height) / offset_factor
+
+    # text label for 1D barcodes
+    text_y = offset_y + draw_height + 4 if not layout_reversed else offset_y - effective_text_size - 4
+    symbol = (offset_x, offset_y, draw_width, draw_height)
+    return CellPlan(symbol, False, ("centred", x + cell_width / 2, text_y), False)
+
+
+def plan_side_by_side(x, y, cell_width, cell_height, barcode_type, layout_reversed, text_size, barcode_size):
+    spacing = 16
+    effective_text_size = text_size * 1.4
+
+    # Make barcode as big as possible in the cell
+    max_barcode_width = cell_width * 0.55
+    max_barcode_height = cell_height * 0.95
+    width_pts = min(barcode_size, max_barcode_width)
+    height_pts = min(barcode_size, max_barcode_height)
+    if barcode_type in SCALE_HEIGHT_BARCODES:
+        height_pts *= 0.2
+
+    # Vertical centering
+    center_y = y + cell_height / 2
+    barcode_y = center_y - height_pts / 2
+
+    # Compute maximum text width for wrapping
+    max_text_width = max(cell_width * 0.45, cell_width - width_pts - 3 * spacing)
+
+    if not layout_reversed:
+        # Barcode on right, text on left
+        barcode_x = x + cell_width - width_pts - spacing
+        text_edge = barcode_x - spacing
+        free_width = text_edge - x
+    else:
+        # Barcode on left, text on right
+        barcode_x = x + spacing
+        text_edge = barcode_x + width_pts + spacing
+        free_width = x + cell_width - text_edge
+    # wrapped by real width, and kept inside the cell
+    max_width = max(1, min(max_text_width, free_width))
+    align = "right" if not layout_reversed else "left"
+    text = ("wrapped", text_edge, center_y, align, max_width, WRAPPED_MAX_LINES)
+
+    symbol = (barcode_x, barcode_y, width_pts, height_pts) if barcode_type != "none" else None
+    return CellPlan(symbol, False, text, True)
+
+
+def plan_barcode_only(x, y, cell_width, cell_height, barcode_type, barcode_size):
+    if barcode_type == "none":
+        return CellPlan(None, False, None, False)
+    bt = barcode_type.lower()
+
+    # 2D barcodes
+    if bt == "qrcode":
+        base_scale = 0.0085
+        size = min(cell_width, cell_height) * base_scale * barcode_size
+        draw_width = draw_height = size
+    elif bt == "datamatrix":
+        base_scale = 0.0055
+        size = min(cell_width, cell_height) * base_scale * barcode_size
+        draw_width = draw_height = size
+    else:
+        # 1D barcodes
+        base_scale = 0.0065
+        draw_width = cell_width * base_scale * barcode_size
+        draw_height = cell_height * 0.002 * barcode_size  # Shorter height by default
+
+    offset_x = x + (cell_width - draw_width) / 2
+    offset_y = y + (cell_height - draw_height) / 2.3
+    return CellPlan((offset_x, offset_y, draw_width, draw_height), False, None, False)
+
+
+def plan_text_only(x, y, cell_width, cell_height, layout_reversed, rows, columns):
+    # Initial centered positions
+    center_x = x + cell_width / 2
+    center_y = y + cell_height / 2.2
+
+    # Adjust text position based on label density
+    shift = 0.35 * (rows ** 1.15 + columns ** 1.15)
+    if layout_reversed:
+        center_y -= shift
+    else:
+        center_y += shift
+
+    return CellPlan(None, False, ("centred", center_x, center_y), True)
+
+
+@lru_cache(maxsize=256)
+def compile_template(page_width, page_height, rows, columns, layout_mode, barcode_type,
+                     text_size, barcode_size, layout_reversed, x_offset, y_offset):
+    cell_width = page_width / columns
+    cell_height = page_height / rows
+    layout = layout_mode.lower()
+
+    if layout == "stacked":
+        font = ("Helvetica", text_size * 1.5)
+    elif layout == "side_by_side":
+        font = ("Helvetica", text_size * 1.4)
+    elif layout == "barcodeonly":
+        font = None
+    elif layout == "textonly":
+        # Calculate max size allowed based on cell height
+        max_text_size = cell_height * 0.5
+        font = ("Helvetica-Bold", min(text_size, max_text_size) * 1.5)
+    else:
+        raise ValueError(f"Unknown layout mode: {layout_mode}")
+
+    cells = []
+    for r in range(rows):
+        for col in range(columns):
+            x = col * cell_width + x_offset
+            y = r * cell_height + y_offset - rows + columns
+            if layout == "stacked":
+                cell = plan_stacked(x, y+20, cell_width, cell_height, barcode_type, layout_reversed, text_size, barcode_size, rows, columns)
+            elif layout == "side_by_side":
+                cell = plan_side_by_side(x, y, cell_width, cell_height, barcode_type, layout_reversed, text_size, barcode_size)
+            elif layout == "barcodeonly":
+                cell = plan_barcode_only(x, y, cell_width, cell_height, barcode_type, barcode_size)
+            else:
+                cell = plan_text_only(x, y, cell_width, cell_height, layout_reversed, rows, columns)
+            cells.append(cell)
+
+    if not any(cell.text for cell in cells):
+        font = None
+    return LabelTemplate(tuple(cells), font)
@@ -0,0 +1,81 @@
+from reportlab import rl_config
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfdoc
+from reportlab.pdfbase.pdfutils import asciiBase85Encode
+from vector_barcodes import draw_matrix, draw_modules
+
+import zlib
+
+
+# Each unique barcode image is written once as an image XObject wrapped in a
+# unit-square form XObject. Cells then reference the form with a
+# translate/scale, so repeated SKUs cost one "Do" instead of a fresh
+# ImageReader, RGB expansion and md5 of the bitmap per cell.
+
+def bilevel_image_xobject(name, img):
+    # 1-bit DeviceGray image straight from a PIL mode "1" image; PIL packs
+    # rows MSB-first padded to a byte with 0=black, exactly as PDF expects.
+    xobj = pdfdoc.PDFImageXObject(name)
+    xobj.width, xobj.height = img.size
+    xobj.bitsPerComponent = 1
+    xobj.colorSpace = "DeviceGray"
+    xobj.streamContent = zlib.compress(img.tobytes())
+    if rl_config.useA85:
+        xobj.streamContent = asciiBase85Encode(xobj.streamContent)
+        xobj._filters = "ASCII85Decode", "FlateDecode"
+    else:
+        xobj._filters = "FlateDecode",
+    return xobj
+
+
+def register_image_form(c, name, img):
+    c.beginForm(name, 0, 0, 1, 1)
+    if img.mode == "1":
+        # registered the same way canvas.drawImage registers its images
+        image_name = f"{name}_img"
+        c._doc.addForm(image_name, bilevel_image_xobject(image_name, img))
+        c.doForm(image_name)
+    else:
+        c.drawImage(ImageReader(img), 0, 0, width=1, height=1)
+    c.endForm()
+
+
+class ImageForms:
+    def __init__(self, c):
+        self.c = c
+        self._names = {}
+
+    def draw(self, key, img, x, y, width, height):
+        name = self._names.get(key)
+        if name is None:
+            name = f"barcode{len(self._names)}"
+            register_image_form(self.c, name, img)
+            self._names[key] = name
+        self._place(name, x, y, width, height)
+
+    def draw_modules(self, key, encode, x, y, width, height):
+        # vector 1D symbol: encode() gives the module string, drawn as bars
+        self._draw_vector(key, lambda c: draw_modules(c, encode(), 0, 0, 1, 1), x, y, width, height)
+
+    def draw_matrix(self, key, build, x, y, width, height):
+        # vector 2D symbol: build() gives the module matrix, row 0 on top
+        self._draw_vector(key, lambda c: draw_matrix(c, build(), 0, 0, 1, 1), x, y, width, height)
+
+    def _draw_vector(self, key, paint, x, y, width, height):
+        name = self._names.get(key)
+        if name is None:
+            name = f"barcode{len(self._names)}"
+            self.c.beginForm(name, 0, 0, 1, 1)
+            self.c.setFillGray(0)
+            paint(self.c)
+            self.c.endForm()
+            self._names[key] = name
+        self._place(name, x, y, width, height)
+
+    def _place(self, name, x, y, width, height):
+        c = self.c
+        c.saveState()
+        c.translate(x, y)
+        c.scale(width, height)
+        c.doForm(name)
+        c.restoreState()
@@ -0,0 +1,175 @@
+from reportlab.pdfgen import canvas
+from reportlab.pdfbase import pdfdoc
+from reportlab.pdfbase.pdfdoc import PDFIndirectObject, PDFObjectReference, PDFPage, PDFTrailer
+
+import queue
+import threading
+
+
+# A Canvas that writes every finished page to its output as soon as
+# showPage() returns, instead of holding the whole document until save().
+#
+# reportlab numbers objects when they are registered and only formats them
+# in save(). Pages, their content streams, fonts and image/form XObjects
+# are complete once registered, so they are formatted and written right
+# away and then dropped from the document. The few objects that keep
+# changing until the end (font dictionary, page tree, catalog, info,
+# outlines) are held back and written by save(), followed by the xref.
+
+class StreamingCanvas(canvas.Canvas):
+    def __init__(self, sink, *args, **kwargs):
+        self._owns_sink = not hasattr(sink, "write")
+        self._sink = open(sink, "wb") if self._owns_sink else sink
+        super().__init__(self._sink, *args, **kwargs)
+        self._offset = 0
+        self._offsets = {}
+        self._next_number = 1
+        self._deferred = []
+        self._released_pages = 0
+        self._write(pdfdoc.PDFFile(self._doc._pdfVersion).format(self._doc))
+
+    def showPage(self):
+        super().showPage()
+        self._flush()
+
+    def save(self):
+        if len(self._code):
+            self.showPage()
+        # the same finishing steps PDFDocument.GetPDFData does before format()
+        doc = self._doc
+        for fnt in doc.delayedFonts:
+            fnt.addObjects(doc)
+        doc.info.invariant = doc.invariant
+        doc.info.digest(doc.signature)
+        doc.Reference(doc.Catalog)
+        doc.Reference(doc.info)
+        doc.Outlines.prepare(doc, self)
+        if doc.Outlines.ready < 0:
+            doc.Catalog.Outlines = None
+        self._flush(final=True)
+
+        count = len(self._offsets)
+        xref = [f"xref\n0 {count + 1}\n0000000000 65535 f \n"]
+        xref += [f"{self._offsets[n]:010d} 00000 n \n" for n in range(1, count + 1)]
+        startxref = self._write("".join(xref).encode("latin1"))
+        trailer = PDFTrailer(
+            startxref=startxref,
+            Size=count + 1,
+            Root=doc.Reference(doc.Catalog),
+            Info=doc.Reference(doc.info),
+            ID=doc.ID(),
+        )
+        self._write(trailer.format(doc))
+        if self._owns_sink:
+            self._sink.close()
+        elif hasattr(self._sink, "flush"):
+            self._sink.flush()
+
+    def _write(self, data):
+        offset = self._offset
+        self._sink.write(data)
+        self._offset += len(data)
+        return offset
+
+    def _is_deferred(self, oid, obj):
+        doc = self._doc
+        return oid == pdfdoc.BasicFonts or any(
+            obj is held for held in (doc.Catalog, doc.Pages, doc.info, doc.Outlines)
+        )
+
+    def _flush(self, final=False):
+        doc = self._doc
+        retry = self._deferred if final else []
+        if final:
+            self._deferred = []
+        while True:
+            if retry:
+                number = retry.pop(0)
+            elif self._next_number <= doc.objectcounter:
+                # formatting may register new objects (e.g. page contents)
+                number = self._next_number
+                self._next_number += 1
+            else:
+                break
+            oid = doc.numberToId[number]
+            obj = doc.idToObject[oid]
+            if not final and self._is_deferred(oid, obj):
+                self._deferred.append(number)
+                continue
+            data = pdfdoc.pdfdocEnc(PDFIndirectObject(oid, obj).format(doc))
+            self._offsets[number] = self._write(data)
+            doc.idToOffset[oid] = self._offsets[number]
+            if not final:
+                # keep the name registered, drop the content
+                doc.idToObject[oid] = PDFObjectReference(oid)
+
+        pages = doc.Pages.pages
+        for i in range(self._released_pages, len(pages)):
+            if isinstance(pages[i], PDFPage):
+                pages[i] = PDFObjectReference(pages[i].__InternalName__)
+        self._released_pages = len(pages)
+
+
+class _QueueWriter:
+    def __init__(self, chunks, closed, chunk_size):
+        self.chunks = chunks
+        self.closed = closed
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self._put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def _put(self, item):
+        while not self.closed.is_set():
+            try:
+                self.chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+        raise ConnectionAbortedError("PDF stream closed by the client")
+
+
+def stream_pdf(render, chunk_size=64 * 1024, max_chunks=16):
+    # Runs render(sink) in a worker thread and yields the bytes it writes.
+    # The queue is bounded, so a slow client throttles rendering instead of
+    # letting finished pages pile up in memory.
+    chunks = queue.Queue(maxsize=max_chunks)
+    closed = threading.Event()
+    done = object()
+    writer = _QueueWriter(chunks, closed, chunk_size)
+    errors = []
+
+    def run():
+        try:
+            render(writer)
+            writer.flush()
+        except ConnectionAbortedError:
+            pass
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                writer._put(done)
+            except ConnectionAbortedError:
+                pass
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is done:
+                break
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        closed.set()
@@ -0,0 +1,97 @@
+from collections import OrderedDict
+from generator import generate_labels
+
+import io
+import json
+import random
+import subprocess
+import threading
+
+
+# First page of a label run as a small PNG, drawn by generate_labels itself
+# and rasterized by Ghostscript, so the preview matches the real PDF.
+# Random SKUs come from a fixed seed: the same settings always give the same
+# image, which is what lets the result be cached while offsets are tweaked.
+
+PREVIEW_WIDTH_PX = 480
+PREVIEW_SEED = 0
+
+
+class PreviewCache:
+    def __init__(self, max_items=256):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            png = self._items.get(key)
+            if png is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return png
+
+    def put(self, key, png):
+        with self._lock:
+            self._items[key] = png
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+preview_cache = PreviewCache()
+
+
+def preview_options(options):
+    # only what is needed for the first page
+    options = dict(options, quantity=1, render_workers=1, output_format="pdf")
+    sku_list = options.get("sku_list")
+    if isinstance(sku_list, list):
+        options["sku_list"] = sku_list[:options.get("rows", 1) * options.get("columns", 1)]
+    return options
+
+
+def rasterize_first_page(pdf, resolution):
+    from batch_render import TreepoemError, ghostscript_binary
+    gs_process = subprocess.run(
+        [
+            ghostscript_binary(),
+            "-dSAFER",
+            "-dQUIET",
+            "-dNOPAUSE",
+            "-dBATCH",
+            "-sDEVICE=pnggray",
+            f"-r{resolution:.2f}",
+            "-dFirstPage=1",
+            "-dLastPage=1",
+            "-dTextAlphaBits=4",
+            "-dGraphicsAlphaBits=4",
+            "-sOutputFile=-",
+            "-",
+        ],
+        capture_output=True,
+        input=pdf,
+        creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
+    )
+    if gs_process.returncode != 0:
+        raise TreepoemError(gs_process.stderr.decode(errors="replace").strip())
+    return gs_process.stdout
+
+
+def render_preview(options, width_px=PREVIEW_WIDTH_PX):
+    options = preview_options(options)
+    key = (json.dumps(options, sort_keys=True, default=str), width_px)
+    png = preview_cache.get(key)
+    if png is not None:
+        return png
+
+    pdf = io.BytesIO()
+    generate_labels(output_path=pdf, rng=random.Random(PREVIEW_SEED), **options)
+    resolution = width_px / options.get("label_width", 4)
+    png = rasterize_first_page(pdf.getvalue(), resolution)
+    preview_cache.put(key, png)
+    return png
@@ -0,0 +1,424 @@
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont, TiffImagePlugin
+from label_template import CellPlan
+from text_layout import line_baselines, wrap_lines
+from vector_barcodes import encode_modules, qr_matrix, datamatrix_matrix, upce_to_upca, WIDE
+from vector_barcodes import VECTOR_BARCODES, VECTOR_2D_BARCODES
+
+import io
+import os
+import shutil
+import tempfile
+
+
+# Labels written in a thermal printer's own language (ZPL or EPL) instead of
+# as PDF pages, so the printer draws bars and text itself at full speed
+# rather than rasterizing page bitmaps. Cells are laid out from the same
+# label_template plan as the PDF (points, origin bottom-left) and converted
+# to printer dots (origin top-left) at the requested dpi.
+#
+# Symbologies the language has a barcode command for are sent as that
+# command, with the module size chosen so the symbol fills the same box as
+# in the PDF. Anything else is sent as a 1-bit graphic of the usual raster
+# symbol. Each label is written out as soon as it is finished.
+#
+# The same plan can also be drawn straight into 1-bit page images (PNG or
+# TIFF) for printers that only take raster pages; see BitmapLabels.
+
+# output_format -> (mimetype, file extension)
+OUTPUT_FORMATS = {
+    "pdf": ("application/pdf", "pdf"),
+    "zpl": ("text/plain", "zpl"),
+    "epl": ("application/octet-stream", "epl"),
+    "png": ("image/png", "png"),
+    "tiff": ("image/tiff", "tiff"),
+}
+
+
+def bilevel(img, width, height):
+    # img resized to width x height, as a 1-bit image
+    return img.convert("L").resize((width, height), Image.NEAREST).point(lambda v: 255 if v >= 128 else 0, "1")
+
+
+def fit_graphic(img, width, height):
+    # width x height 1-bit image, rows padded to whole bytes with white;
+    # bit 1 is white, as PIL stores mode "1"
+    img = bilevel(img, width, height)
+    row_bytes = -(-width // 8)
+    padded = Image.new("1", (row_bytes * 8, height), 1)
+    padded.paste(img, (0, 0))
+    return row_bytes, padded.tobytes()
+
+
+class PrinterLabels:
+    NATIVE_BARCODES = set()
+    MATRIX_BARCODES = set()
+    OPEN_MODE = "wb"
+
+    def __init__(self, output, pagesize, dpi):
+        self._owns_output = not hasattr(output, "write")
+        self._output = open(output, self.OPEN_MODE) if self._owns_output else output
+        self.scale = dpi / 72
+        self.dpi = dpi
+        self.width = self.dots(pagesize[0])
+        self.height = self.dots(pagesize[1])
+        self.font = None
+        self._commands = []
+        self._output.write(self.document_start())
+
+    def dots(self, pts):
+        return round(pts * self.scale)
+
+    def top(self, y):
+        # PDF y (points from the bottom) to dots from the top
+        return self.height - self.dots(y)
+
+    @staticmethod
+    def origin(x, y):
+        # printers reject negative positions; what the PDF would draw past
+        # the top or left edge is pulled onto the label instead
+        return f"{max(0, x)},{max(0, y)}"
+
+    @classmethod
+    def sends_graphic(cls, barcode_type):
+        # whether barcode_type is sent as a graphic of the raster symbol
+        return barcode_type not in cls.NATIVE_BARCODES and barcode_type not in cls.MATRIX_BARCODES
+
+    def setFont(self, name, size):
+        self.font = (name, size)
+
+    def draw_cell(self, cell: CellPlan, barcode_type, sku, display_text, image):
+        # image() gives the raster symbol, for types sent as a graphic
+        if cell.text and cell.text_first:
+            self.draw_text(cell.text, display_text)
+        if cell.symbol:
+            self.draw_symbol(cell.symbol, cell.stacked_2d, barcode_type, sku, image)
+        if cell.text and not cell.text_first:
+            self.draw_text(cell.text, display_text)
+
+    def draw_text(self, text, display_text):
+        font_name, font_size = self.font
+        if text[0] == "centred":
+            _, text_x, text_y = text
+            self.text(display_text, self.dots(text_x), self.top(text_y), font_size, "center")
+            return
+
+        # side_by_side: the same line breaks and baselines as the PDF
+        _, edge_x, center_y, align, max_width, max_lines = text
+        lines = wrap_lines(display_text, font_name, font_size, max_width, max_lines)
+        for (line, _), line_y in zip(lines, line_baselines(len(lines), center_y, font_size)):
+            self.text(line, self.dots(edge_x), self.top(line_y), font_size, align, self.dots(max_width))
+
+    def draw_symbol(self, symbol, stacked_2d, barcode_type, sku, image):
+        x, y, width, height = symbol
+        left, top = self.dots(x), self.top(y + height)
+        width, height = max(1, self.dots(width)), max(1, self.dots(height))
+        if barcode_type in self.MATRIX_BARCODES:
+            sent = self.matrix_barcode(barcode_type, sku, stacked_2d, left, top, width, height)
+        elif barcode_type in self.NATIVE_BARCODES:
+            sent = self.linear_barcode(barcode_type, sku, left, top, width, height)
+        else:
+            sent = False
+        if not sent:
+            self.graphic(image(), left, top, width, height)
+
+    def linear_barcode(self, barcode_type, sku, left, top, width, height):
+        # narrow module size that fits the width (printers take 1-10 dots),
+        # centred in the box like the PDF's stretched symbol; encoding the
+        # modules also validates the data
+        modules = encode_modules(barcode_type, sku)
+        module = max(1, min(10, width // len(modules)))
+        left += (width - module * len(modules)) // 2
+        return self.barcode(barcode_type, sku, left, top, module, height)
+
+    def showPage(self):
+        self._output.write(self.label(self._commands))
+        self._commands = []
+
+    def save(self):
+        if self._commands:
+            self.showPage()
+        if self._owns_output:
+            self._output.close()
+        elif hasattr(self._output, "flush"):
+            self._output.flush()
+
+    def document_start(self):
+        return b""
+
+
+class ZplLabels(PrinterLabels):
+    NATIVE_BARCODES = {"code128", "code39", "ean13", "ean8", "upca", "upce", "interleaved2of5"}
+    MATRIX_BARCODES = {"qrcode", "datamatrix"}
+
+    # barcode_type -> (^B command, digits sent; the printer adds the check digit)
+    COMMANDS = {
+        "code128": ("^BCN,{height},N,N,N,A", None),
+        "code39": ("^B3N,N,{height},N,N", None),
+        "ean13": ("^BEN,{height},N,N", 12),
+        "ean8": ("^B8N,{height},N,N", 7),
+        "upca": ("^BUN,{height},N,N,Y", 11),
+        "upce": ("^B9N,{height},N,N,Y", 10),
+        "interleaved2of5": ("^B2N,{height},N,N,N", None),
+    }
+
+    @staticmethod
+    def field(data):
+        # ^FH: _ followed by two hex digits, so ^ ~ and _ can't end the field
+        return "^FH^FD" + data.replace("_", "_5F").replace("^", "_5E").replace("~", "_7E") + "^FS"
+
+    def text(self, data, x, baseline, font_size, align, width=None):
+        height = max(1, self.dots(font_size))
+        if align == "center":
+            half = max(1, min(x, self.width - x))
+            left, width, justify = x - half, 2 * half, "C"
+        elif align == "right":
+            left, justify = x - width, "R"
+        else:
+            left, justify = x, "L"
+        # ^FT on a one-line ^FB block puts the baseline at y, as in the PDF
+        self._commands.append(
+            f"^FT{self.origin(left, baseline)}^A0N,{height},{height}^FB{max(1, width)},1,0,{justify}" + self.field(data)
+        )
+
+    def barcode(self, barcode_type, sku, left, top, module, height):
+        command, digits = self.COMMANDS[barcode_type]
+        if barcode_type == "upce":
+            if sku[0] != "0":
+                return False  # ^B9 only prints number system 0
+            sku = upce_to_upca(sku[:7])[1:]
+        elif barcode_type == "interleaved2of5" and len(sku) % 2:
+            sku = "0" + sku
+        elif barcode_type == "code39":
+            sku = sku.upper()
+        if digits:
+            sku = sku[:digits]
+        ratio = f"{WIDE:.1f}"
+        self._commands.append(
+            f"^FO{self.origin(left, top)}^BY{module},{ratio},{height}" + command.format(height=height) + self.field(sku)
+        )
+        return True
+
+    def matrix_barcode(self, barcode_type, sku, stacked_2d, left, top, width, height):
+        # Module size from the symbol the PDF draws; the quiet zone that
+        # symbol includes is left blank around the printed one.
+        if barcode_type == "qrcode":
+            level, border = ("L", 1) if stacked_2d else ("M", 4)
+            size = len(qr_matrix(sku, level, border=0))
+            module = max(1, min(10, width // (size + 2 * border)))
+            offset = border * module
+            self._commands.append(
+                f"^FO{self.origin(left + offset, top + offset)}^BQN,2,{module}" + self.field(f"{level}A,{sku}")
+            )
+        else:
+            quiet = 2 if stacked_2d else 0
+            size = len(datamatrix_matrix(sku, quiet_zone=False))
+            module = max(1, width // (size + 2 * quiet))
+            offset = quiet * module
+            self._commands.append(f"^FO{self.origin(left + offset, top + offset)}^BXN,{module},200" + self.field(sku))
+        return True
+
+    def graphic(self, img, left, top, width, height):
+        row_bytes, data = fit_graphic(img, width, height)
+        # ^GF counts set bits as black
+        data = bytes(b ^ 0xFF for b in data)
+        self._commands.append(f"^FO{self.origin(left, top)}^GFA,{len(data)},{len(data)},{row_bytes},{data.hex().upper()}^FS")
+
+    def label(self, commands):
+        head = f"^XA^CI28^PW{self.width}^LL{self.height}^LH0,0"
+        return ("\n".join([head] + commands + ["^XZ"]) + "\n").encode("utf-8")
+
+
+class EplLabels(PrinterLabels):
+    # UPC-E, QR and DataMatrix are sent as graphics: EPL2 support for them
+    # differs between printer models.
+    NATIVE_BARCODES = {"code128", "code39", "ean13", "ean8", "upca", "interleaved2of5"}
+
+    BARCODE_TYPES = {
+        "code128": ("1", None),
+        "code39": ("3", None),
+        "ean13": ("E30", 12),
+        "ean8": ("E80", 7),
+        "upca": ("UA0", 11),
+        "interleaved2of5": ("2", None),
+    }
+
+    # resident fonts: (font, character pitch, height) in dots at 203 and 300 dpi
+    FONTS = {
+        203: [("1", 10, 12), ("2", 12, 16), ("3", 14, 20), ("4", 16, 24)],
+        300: [("1", 14, 20), ("2", 18, 28), ("3", 22, 36), ("4", 26, 44)],
+    }
+
+    @staticmethod
+    def quoted(data):
+        return '"' + data.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+    def pick_font(self, font_size):
+        # the resident font and multiplier closest to the PDF text height
+        target = self.dots(font_size)
+        fonts = self.FONTS[300 if self.dpi >= 300 else 203]
+        return min(
+            ((font, mult, width * mult, height * mult) for font, width, height in fonts for mult in range(1, 7)),
+            key=lambda f: abs(f[3] - target),
+        )
+
+    def text(self, data, x, baseline, font_size, align, width=None):
+        font, mult, char_width, char_height = self.pick_font(font_size)
+        # fixed-pitch fonts: the line width is known up front
+        line_width = len(data) * char_width
+        if align == "center":
+            x -= line_width // 2
+        elif align == "right":
+            x -= line_width
+        top = baseline - char_height * 3 // 4  # baseline sits about 3/4 down the cell
+        self._commands.append(f"A{self.origin(x, top)},0,{font},{mult},{mult},N,{self.quoted(data)}")
+
+    def barcode(self, barcode_type, sku, left, top, module, height):
+        code, digits = self.BARCODE_TYPES[barcode_type]
+        if barcode_type == "interleaved2of5" and len(sku) % 2:
+            sku = "0" + sku
+        elif barcode_type == "code39":
+            sku = sku.upper()
+        if digits:
+            sku = sku[:digits]
+        self._commands.append(f"B{self.origin(left, top)},0,{code},{module},{module * WIDE},{height},N,{self.quoted(sku)}")
+        return True
+
+    def graphic(self, img, left, top, width, height):
+        row_bytes, data = fit_graphic(img, width, height)
+        # GW prints cleared bits, which is how PIL stores black
+        self._commands.append(f"GW{self.origin(left, top)},{row_bytes},{height},".encode("ascii") + data)
+
+    def document_start(self):
+        return f"\nq{self.width}\nQ{self.height},24\n".encode("ascii")
+
+    def label(self, commands):
+        lines = [b"N"]
+        for command in commands:
+            lines.append(command if isinstance(command, bytes) else command.encode("latin-1", "replace"))
+        lines.append(b"P1")
+        return b"\n".join(lines) + b"\n"
+
+
+# TrueType fonts for text on bitmap pages, tried in order for each PDF
+# font. LABEL_FONT and LABEL_BOLD_FONT name a font file to use instead.
+# Line breaks still come from the PDF font's metrics (text_layout).
+BITMAP_FONTS = {
+    "Helvetica": [os.environ.get("LABEL_FONT"), "LiberationSans-Regular.ttf", "Arial.ttf", "DejaVuSans.ttf"],
+    "Helvetica-Bold": [os.environ.get("LABEL_BOLD_FONT"), "LiberationSans-Bold.ttf", "Arial Bold.ttf", "DejaVuSans-Bold.ttf"],
+}
+
+# text alignment -> PIL anchor on the baseline
+TEXT_ANCHORS = {"left": "ls", "center": "ms", "right": "rs"}
+
+
+@lru_cache(maxsize=64)
+def bitmap_font(name, size):
+    for font in BITMAP_FONTS.get(name, BITMAP_FONTS["Helvetica"]):
+        if font:
+            try:
+                return ImageFont.truetype(font, size)
+            except OSError:
+                pass
+    return ImageFont.load_default(size)  # bundled with Pillow; no bold
+
+
+@lru_cache(maxsize=1024)
+def module_image(barcode_type, sku, stacked_2d):
+    # The symbol at one pixel per module, dark modules set: the same
+    # modules a vector PDF draws. Shared between documents, so repeated SKUs
+    # are encoded once.
+    if barcode_type == "qrcode":
+        matrix = qr_matrix(sku, "L", border=1) if stacked_2d else qr_matrix(sku)
+    elif barcode_type == "datamatrix":
+        matrix = datamatrix_matrix(sku, quiet_zone=stacked_2d)
+    else:
+        matrix = [[module == "1" for module in encode_modules(barcode_type, sku)]]
+    data = bytes(255 if dark else 0 for row in matrix for dark in row)
+    return Image.frombytes("L", (len(matrix[0]), len(matrix)), data).point(lambda v: v, "1")
+
+
+class BitmapLabels(PrinterLabels):
+    # Whole pages as 1-bit images at dpi. Symbols are drawn from their
+    # modules at a whole number of pixels per module (so bars and cells stay
+    # sharp and even), as large as fits the box the PDF stretches them to
+    # and centred in it. Text is drawn as 1-bit glyphs on its baseline.
+    NATIVE_BARCODES = VECTOR_BARCODES
+    MATRIX_BARCODES = VECTOR_2D_BARCODES
+
+    def __init__(self, output, pagesize, dpi):
+        super().__init__(output, pagesize, dpi)
+        self.new_page()
+
+    def new_page(self):
+        self.page = Image.new("1", (self.width, self.height), 1)
+        self._draw = ImageDraw.Draw(self.page)
+
+    def text(self, data, x, baseline, font_size, align, width=None):
+        font = bitmap_font(self.font[0], max(1, self.dots(font_size)))
+        self._draw.text((x, baseline), data, font=font, fill=0, anchor=TEXT_ANCHORS[align])
+
+    def linear_barcode(self, barcode_type, sku, left, top, width, height):
+        self.paste_modules(module_image(barcode_type, sku, False), left, top, width, height)
+        return True
+
+    def matrix_barcode(self, barcode_type, sku, stacked_2d, left, top, width, height):
+        self.paste_modules(module_image(barcode_type, sku, stacked_2d), left, top, width, height)
+        return True
+
+    def paste_modules(self, symbol, left, top, width, height):
+        columns, rows = symbol.size
+        module_width, module_height = max(1, width // columns), max(1, height // rows)
+        symbol = symbol.resize((columns * module_width, rows * module_height), Image.NEAREST)
+        # only the dark modules are painted, as in the PDF
+        self._draw.bitmap((left + (width - symbol.width) // 2, top + (height - symbol.height) // 2), symbol, fill=0)
+
+    def graphic(self, img, left, top, width, height):
+        self.page.paste(bilevel(img, width, height), (left, top))
+
+    def showPage(self):
+        self.write_page(self.page)
+        self.new_page()
+
+
+class PngLabels(BitmapLabels):
+    # every page a complete PNG file, one after the other
+    def write_page(self, page):
+        png = io.BytesIO()
+        page.save(png, "PNG", dpi=(self.dpi, self.dpi))
+        self._output.write(png.getvalue())
+
+
+class TiffLabels(BitmapLabels):
+    # One multi-page TIFF, CCITT group 4, with pages appended as they are
+    # finished. TIFF needs to seek back, so a stream is written to a temp
+    # file first and copied out by save().
+    OPEN_MODE = "w+b"
+
+    def __init__(self, output, pagesize, dpi):
+        super().__init__(output, pagesize, dpi)
+        self._target = None
+        if not (getattr(self._output, "seekable", lambda: False)() and getattr(self._output, "readable", lambda: False)()):
+            self._target, self._output = self._output, tempfile.TemporaryFile()
+        self._tiff = TiffImagePlugin.AppendingTiffWriter(self._output, new=True)
+
+    def write_page(self, page):
+        page.save(self._tiff, "TIFF", compression="group4", dpi=(self.dpi, self.dpi))
+        self._tiff.newFrame()
+
+    def save(self):
+        self._tiff.close()
+        if self._target is not None:
+            self._output.seek(0)
+            shutil.copyfileobj(self._output, self._target)
+            self._output.close()
+            self._output = self._target
+        super().save()
+
+
+PRINTER_LABELS = {"zpl": ZplLabels, "epl": EplLabels, "png": PngLabels, "tiff": TiffLabels}
+
+
+def uses_raster(output_format, barcode_type):
+    # whether this format sends barcode_type as a graphic of the raster symbol
+    return PRINTER_LABELS[output_format].sends_graphic(barcode_type)
@@ -0,0 +1,93 @@
+from printer_labels import OUTPUT_FORMATS
+
+import random
+import re
+
+
+# The label options of a /generate request (JSON body or form fields), as
+# generate_labels keyword arguments. Shared by app and label_batch.
+
+def as_bool(value):
+    if isinstance(value, str):
+        return value.lower() == "true"
+    return bool(value)
+
+
+def label_options(data, sku_file=None):
+    barcode_type = data.get("barcode_type", "code128")
+    quantity = int(data.get("quantity", 1))
+    rng_length = int(data.get("rng_length", 6))
+    prefix = data.get("prefix", "")
+    suffix = data.get("suffix", "")
+    label_width = float(data.get("label_width", 4))
+    label_height = float(data.get("label_height", 6))
+    rows = int(data.get("rows", 1))
+    columns = int(data.get("columns", 1))
+    rng_charset = data.get("rng_charset", "digits")
+    repeat_skus = as_bool(data.get("repeat_skus", False))
+    no_symbols = as_bool(data.get("no_symbols", False))
+    unique_skus = as_bool(data.get("unique_skus", False))
+    fix_check_digits = as_bool(data.get("fix_check_digits", False))
+    layout_mode = data.get("layout_mode", "stacked")
+    text_size = int(data.get("text_size", 14))
+    barcode_size = int(data.get("barcode_size", 150))
+    layout_reversed = as_bool(data.get("layout_reversed", False))
+    dpi = int(data.get("dpi", 300))
+    render_mode = data.get("render_mode", "raster")
+    output_format = data.get("output_format", "pdf")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    raw_skus = data.get("sku_list", "")
+    if sku_file is not None:
+        sku_list = sku_file
+    elif isinstance(raw_skus, list):
+        sku_list = raw_skus
+    else:
+        sku_list = re.split(r"[,\s]+", raw_skus.strip())
+        sku_list = [sku for sku in sku_list if sku]
+    x_offset = float(data.get("x_offset", 0))
+    y_offset = float(data.get("y_offset", 0))
+    truncate_templates = data.get("truncate_templates", [])
+    if isinstance(truncate_templates, str):
+        truncate_templates = [int(n) for n in re.split(r"[,\s]+", truncate_templates.strip()) if n]
+
+    use_manual_preview = sku_file is not None or as_bool(data.get("use_manual_preview", False))
+
+    return dict(
+        barcode_type=barcode_type,
+        quantity=quantity,
+        rng_length=rng_length,
+        prefix=prefix,
+        suffix=suffix,
+        label_width=label_width,
+        label_height=label_height,
+        rows=rows,
+        columns=columns,
+        rng_charset=rng_charset,
+        repeat_skus=repeat_skus,
+        no_symbols=no_symbols,
+        unique_skus=unique_skus,
+        fix_check_digits=fix_check_digits,
+        layout_mode=layout_mode,
+        text_size=text_size,
+        barcode_size=barcode_size,
+        layout_reversed=layout_reversed,
+        dpi=dpi,
+        render_mode=render_mode,
+        output_format=output_format,
+        sku_list = sku_list,
+        use_manual_preview=use_manual_preview,
+        x_offset=x_offset,
+        y_offset=y_offset,
+        truncate_templates=truncate_templates
+    )
+
+
+def seed_option(data, options):
+    # an explicit seed makes random SKUs repeatable (and cacheable)
+    seed = data.get("seed")
+    if seed is None or seed == "":
+        return None
+    seed = int(seed)
+    options["rng"] = random.Random(seed)
+    return seed
@@ -0,0 +1,397 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from generator import generate_labels
+from itertools import islice
+from PIL import Image, TiffImagePlugin
+from printer_labels import PRINTER_LABELS
+from reportlab.lib.units import inch
+from sku_sources import SkuLines, repeat_to, write_sku_lines
+from sku_validation import check_skus, with_check_digits
+from timing import StageTimer, stage_metrics
+
+import io
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+# One label job split into page ranges ("shards") that are rendered
+# separately and then joined in order, so a huge job can use several
+# processes or hosts. Every shard gets the same SKUs it would get in a
+# single run: a manual list is expanded once (repeated, check digits fixed)
+# and streamed into one file of rows per shard, and random SKUs come from
+# the same rng state, replayed up to the shard's first label (see the pages
+# argument of generate_labels).
+#
+# A shard is described by a JSON-safe spec, {"options", "pages", "rng",
+# "timed"} plus "sku_path" for manual SKUs, so it can be sent to another
+# machine along with that file. Shard PDFs are
+# joined by copying their objects (renumbered) into one file; nothing is
+# rendered again. A timed shard sends back its stage totals, which are
+# added to the job's StageTimer.
+
+# options that only make sense in the coordinating process
+LOCAL_OPTIONS = {"output_path", "streaming", "progress", "timer", "rng", "sku_index"}
+
+
+def shard_pages(total_pages, shards):
+    # (first, stop) page ranges: shards nearly equal, contiguous parts
+    shards = max(1, min(shards, total_pages))
+    size, extra = divmod(total_pages, shards)
+    ranges = []
+    first = 0
+    for n in range(shards):
+        stop = first + size + (n < extra)
+        ranges.append((first, stop))
+        first = stop
+    return ranges
+
+
+def shard_specs(options, shards, sku_dir=None):
+    # Manual SKUs are streamed into one file per shard in sku_dir, never
+    # held in memory all at once.
+    if options.get("sku_index") is not None:
+        raise ValueError("Jobs that claim SKUs from sku_index can't be sharded.")
+    options = dict(options)
+    total_labels = options["quantity"] * options.get("rows", 1) * options.get("columns", 1)
+    timed = options.get("timer") is not None
+    rng_state = None
+    manual = options.get("use_manual_preview") and options.get("sku_list")
+    if manual:
+        if sku_dir is None:
+            raise ValueError("Sharding manual SKUs needs a directory for the shards' SKU files.")
+        if options.get("validate", True):
+            # the rows that get printed
+            check_skus(islice(options["sku_list"], total_labels), options["barcode_type"], options.get("prefix", ""),
+                       options.get("suffix", ""), options.get("fix_check_digits", False),
+                       label_count=None if options.get("repeat_skus") else total_labels)
+        # every label's SKU, as generate_labels would draw them
+        skus = repeat_to(options["sku_list"], total_labels, options.get("repeat_skus", False))
+        if options.get("fix_check_digits"):
+            skus = with_check_digits(skus, options["barcode_type"], options.get("prefix", ""), options.get("suffix", ""))
+            options.update(prefix="", suffix="", fix_check_digits=False)
+        options.update(sku_list=None, repeat_skus=False)
+    else:
+        rng = options.get("rng")
+        if rng is None:
+            rng = random.Random(random.SystemRandom().getrandbits(64))
+        elif isinstance(rng, random.SystemRandom):
+            raise ValueError("SystemRandom SKUs can't be sharded; pass a random.Random.")
+        version, state, gauss_next = rng.getstate()
+        rng_state = [version, list(state), gauss_next]
+        options["sku_list"] = None
+    options["validate"] = False
+    options = {name: value for name, value in options.items() if name not in LOCAL_OPTIONS}
+    labels_per_page = options.get("rows", 1) * options.get("columns", 1)
+    specs = []
+    for n, (first, stop) in enumerate(shard_pages(options["quantity"], shards)):
+        spec = {"options": options, "pages": [first, stop], "rng": rng_state, "timed": timed}
+        if manual:
+            # a job of its own: just this shard's pages and SKUs
+            spec["options"] = dict(options, quantity=stop - first)
+            spec["sku_path"] = os.path.join(sku_dir, f"{n}.skus")
+            with open(spec["sku_path"], "w", encoding="utf-8") as f:
+                write_sku_lines(f, islice(skus, (stop - first) * labels_per_page))
+        specs.append(spec)
+    return specs
+
+
+def render_shard(spec, output_path):
+    # spec["pages"] is the shard's place in the whole job. Returns the
+    # shard's StageTimer totals if it is timed, else None.
+    options = dict(spec["options"])
+    first, stop = spec["pages"]
+    if spec["rng"] is not None:
+        version, state, gauss_next = spec["rng"]
+        options["rng"] = rng = random.Random()
+        rng.setstate((version, tuple(state), gauss_next))
+    else:
+        # manual SKUs: the options and SKU file hold only this shard's pages
+        first, stop = 0, stop - first
+        options["sku_list"] = SkuLines(spec["sku_path"])
+    timer = StageTimer() if spec.get("timed") else None
+    generate_labels(output_path=output_path, pages=(first, stop), timer=timer, **options)
+    return timer.totals() if timer else None
+
+
+class ProcessShardWorkers:
+    # shards rendered by local worker processes, straight to their files
+    def __init__(self, workers):
+        self._pool = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, spec, output_path):
+        return self._pool.submit(render_shard, spec, output_path)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+class CommandShardWorkers:
+    # Stand-in for remote workers: each shard is sent as a line of JSON to
+    # the stdin of a new command, followed by its SKU file if it has one,
+    # and its document read back from stdout, with no shared memory or
+    # files. The default command runs this module locally;
+    # something like ["ssh", host, "python", "-m", "sharding"] runs it
+    # elsewhere. Stage totals come back as the last line of stderr.
+    def __init__(self, workers, command=None):
+        self.command = command or [sys.executable, "-m", "sharding"]
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="label-shard")
+
+    def submit(self, spec, output_path):
+        return self._pool.submit(self._run, spec, output_path)
+
+    def _run(self, spec, output_path):
+        with tempfile.TemporaryFile() as stdin:
+            stdin.write(json.dumps(dict(spec, sku_path="-" if spec.get("sku_path") else None)).encode("utf-8") + b"\n")
+            if spec.get("sku_path"):
+                with open(spec["sku_path"], "rb") as f:
+                    shutil.copyfileobj(f, stdin)
+            stdin.seek(0)
+            result = subprocess.run(
+                self.command,
+                stdin=stdin,
+                capture_output=True,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+        if result.returncode:
+            error = result.stderr.decode("utf-8", "replace").strip().splitlines()
+            raise RuntimeError(f"Shard {spec['pages']} failed: {error[-1] if error else result.returncode}")
+        with open(output_path, "wb") as f:
+            f.write(result.stdout)
+        if spec.get("timed"):
+            lines = result.stderr.decode("utf-8", "replace").strip().splitlines()
+            return json.loads(lines[-1]) if lines else None
+        return None
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+def render_sharded(output_path="output.pdf", shards=2, workers=None, progress=None, **options):
+    # Same arguments as generate_labels; the job is rendered as `shards`
+    # page ranges by workers (default: that many local processes) and
+    # joined into output_path.
+    total_pages = options["quantity"]
+    timer = options.get("timer")
+
+    with tempfile.TemporaryDirectory(prefix="label-shards-") as shard_dir:
+        specs = shard_specs(options, shards, shard_dir)
+        own_workers = workers is None
+        if own_workers:
+            workers = ProcessShardWorkers(len(specs))
+        if progress:
+            progress(0, total_pages)
+        paths = [os.path.join(shard_dir, f"{n}.part") for n in range(len(specs))]
+        try:
+            futures = [workers.submit(spec, path) for spec, path in zip(specs, paths)]
+            pages_done = 0
+            for spec, future in zip(specs, futures):
+                totals = future.result()
+                if timer and totals:
+                    timer.add(totals)
+                first, stop = spec["pages"]
+                pages_done += stop - first
+                if progress:
+                    progress(pages_done, total_pages)
+        finally:
+            if own_workers:
+                workers.shutdown()
+
+        if timer:
+            timer.start("merge")
+        output_format = options.get("output_format", "pdf")
+        if output_format == "tiff":
+            merge_tiffs(paths, output_path)
+        elif output_format in PRINTER_LABELS:
+            pagesize = (options.get("label_width", 4) * inch, options.get("label_height", 6) * inch)
+            start = PRINTER_LABELS[output_format](io.BytesIO(), pagesize, options.get("dpi", 300)).document_start()
+            merge_printer_labels(paths, output_path, len(start))
+        else:
+            merge_pdfs(paths, output_path)
+        if timer:
+            timer.stop()
+
+    if timer:
+        # the shards' stages, once for the whole job as generate_labels would
+        labels_per_page = options.get("rows", 1) * options.get("columns", 1)
+        stage_metrics.record(
+            timer, options["barcode_type"], options.get("layout_mode", "stacked"), total_pages * labels_per_page, total_pages
+        )
+    return output_path
+
+
+def merge_printer_labels(paths, output_path, start_length):
+    # ZPL/EPL labels and PNG pages are independent; later shards lose their
+    # document start
+    with open_output(output_path) as out:
+        for n, path in enumerate(paths):
+            with open(path, "rb") as f:
+                if n:
+                    f.seek(start_length)
+                while chunk := f.read(64 * 1024):
+                    out.write(chunk)
+    return output_path
+
+
+def merge_tiffs(paths, output_path):
+    # pages are copied over one by one (G4 re-encoded, not re-rendered)
+    with open(output_path, "w+b") as out:
+        tiff = TiffImagePlugin.AppendingTiffWriter(out, new=True)
+        for path in paths:
+            with Image.open(path) as shard:
+                for n in range(shard.n_frames):
+                    shard.seek(n)
+                    shard.save(tiff, "TIFF", compression="group4", dpi=shard.info.get("dpi"))
+                    tiff.newFrame()
+        tiff.close()
+    return output_path
+
+
+def open_output(output_path):
+    # a path, or an open file object as in generate_labels
+    if hasattr(output_path, "write"):
+        return nullcontext(output_path)
+    return open(output_path, "wb")
+
+
+# Joining reportlab PDFs. reportlab writes each object once, one after the
+# other, followed by a single xref section and the trailer; that is all this
+# relies on. A shard's objects keep their order and get new numbers; its
+# catalog, info and page tree are replaced by one of each for the whole
+# document (the first shard's catalog and info, with all pages as kids).
+
+REFERENCE = re.compile(rb"(\d+) 0 R\b")
+OBJECT_HEADER = re.compile(rb"\d+ 0 obj")
+STREAM = re.compile(rb"stream\r?\n")
+
+
+class ShardPdf:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 1024))
+            self.startxref = int(re.findall(rb"startxref\s+(\d+)", f.read())[-1])
+            f.seek(self.startxref)
+            xref, trailer = f.read().split(b"trailer", 1)
+
+            offsets = {}
+            for number, line in enumerate(xref.splitlines()[3:], start=1):
+                offset, _, kind = line.split()[:3]
+                if kind == b"n":
+                    offsets[number] = int(offset)
+            # (number, start, end) of every object, in file order
+            ordered = sorted(offsets.items(), key=lambda item: item[1])
+            ends = [offset for _, offset in ordered[1:]] + [self.startxref]
+            self.spans = [(number, offset, end) for (number, offset), end in zip(ordered, ends)]
+            self._spans = {number: (start, end) for number, start, end in self.spans}
+
+            self.root = int(re.search(rb"/Root (\d+) 0 R", trailer).group(1))
+            self.info = int(re.search(rb"/Info (\d+) 0 R", trailer).group(1))
+            id_match = re.search(rb"/ID\s*(\[[^\]]*\])", trailer)
+            self.id = id_match.group(1) if id_match else None
+
+            f.seek(0)
+            self.header = f.read(ordered[0][1])
+            self.catalog = self.read(f, self.root)
+            self.info_object = self.read(f, self.info)
+            self.pages = int(re.search(rb"/Pages (\d+) 0 R", self.catalog).group(1))
+            kids = re.search(rb"/Kids \[([^\]]*)\]", self.read(f, self.pages)).group(1)
+            self.kids = [int(number) for number in REFERENCE.findall(kids)]
+
+    def read(self, f, number):
+        start, end = self._spans[number]
+        f.seek(start)
+        return f.read(end - start)
+
+
+def renumber(obj, number, numbers):
+    # the object as number, its references through numbers; stream data
+    # is copied untouched
+    obj = OBJECT_HEADER.sub(f"{number} 0 obj".encode("ascii"), obj, count=1)
+    stream = STREAM.search(obj)
+    head, tail = (obj[:stream.start()], obj[stream.start():]) if stream else (obj, b"")
+    head = REFERENCE.sub(lambda m: f"{numbers[int(m.group(1))]} 0 R".encode("ascii"), head)
+    return head + tail
+
+
+def merge_pdfs(paths, output_path):
+    shards = [ShardPdf(path) for path in paths]
+
+    # new numbers: all kept objects in order, then page tree, catalog, info
+    numbers = []
+    next_number = 1
+    for shard in shards:
+        skip = {shard.root, shard.info, shard.pages}
+        shard_numbers = {}
+        for number, _, _ in shard.spans:
+            if number not in skip:
+                shard_numbers[number] = next_number
+                next_number += 1
+        numbers.append(shard_numbers)
+    pages_number, catalog_number, info_number = next_number, next_number + 1, next_number + 2
+    for shard, shard_numbers in zip(shards, numbers):
+        shard_numbers[shard.pages] = pages_number
+
+    offsets = []
+    with open_output(output_path) as out:
+        position = 0
+
+        def write(data):
+            nonlocal position
+            out.write(data)
+            position += len(data)
+
+        write(shards[0].header)
+        for shard, shard_numbers in zip(shards, numbers):
+            with open(shard.path, "rb") as f:
+                for number, _, _ in shard.spans:
+                    if number not in shard_numbers or number == shard.pages:
+                        continue
+                    offsets.append(position)
+                    write(renumber(shard.read(f, number), shard_numbers[number], shard_numbers))
+
+        kids = " ".join(
+            f"{shard_numbers[kid]} 0 R" for shard, shard_numbers in zip(shards, numbers) for kid in shard.kids
+        )
+        page_count = sum(len(shard.kids) for shard in shards)
+        offsets.append(position)
+        write(f"{pages_number} 0 obj\n<<\n/Count {page_count} /Kids [ {kids} ] /Type /Pages\n>>\nendobj\n".encode("ascii"))
+        first = shards[0]
+        offsets.append(position)
+        write(renumber(first.catalog, catalog_number, numbers[0]))
+        offsets.append(position)
+        write(renumber(first.info_object, info_number, numbers[0]))
+
+        startxref = position
+        xref = [f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n"]
+        xref += [f"{offset:010d} 00000 n \n" for offset in offsets]
+        write("".join(xref).encode("ascii"))
+        trailer = [b"trailer\n<<\n"]
+        if first.id:
+            trailer.append(b"/ID \n" + first.id + b"\n")
+        trailer.append(f"/Info {info_number} 0 R\n/Root {catalog_number} 0 R\n/Size {len(offsets) + 1}\n>>\n".encode("ascii"))
+        trailer.append(f"startxref\n{startxref}\n%%EOF\n".encode("ascii"))
+        write(b"".join(trailer))
+    return output_path
+
+
+if __name__ == "__main__":
+    # one shard: spec as a line of JSON on stdin, then its SKUs if any;
+    # document on stdout
+    spec = json.loads(sys.stdin.buffer.readline())
+    document = io.BytesIO()
+    with tempfile.TemporaryDirectory(prefix="label-shard-") as sku_dir:
+        if spec.get("sku_path"):
+            spec["sku_path"] = os.path.join(sku_dir, "shard.skus")
+            with open(spec["sku_path"], "wb") as f:
+                shutil.copyfileobj(sys.stdin.buffer, f)
+        totals = render_shard(spec, document)
+    sys.stdout.buffer.write(document.getvalue())
+    if totals is not None:
+        print(json.dumps(totals), file=sys.stderr)
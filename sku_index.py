@@ -0,0 +1,61 @@
+import sqlite3
+import threading
+import time
+
+
+# Every random SKU ever issued, so RNG runs never reprint a SKU that is
+# already on a shelf. Keys are the full printed SKU (prefix + random part +
+# suffix), which covers the charset/length/prefix combinations.
+#
+# claim() checks and records a batch in one write transaction: INSERT OR
+# IGNORE only inserts SKUs that are not in the table yet, so two requests
+# (or two server processes) can never both be handed the same SKU. The
+# primary key lookup that the insert does anyway is the membership test.
+# SKUs are recorded when they are handed out, so a run that fails later
+# still retires its SKUs.
+
+class IssuedSkuIndex:
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS issued ("
+            " sku TEXT PRIMARY KEY,"
+            " issued_at REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # autocommit; transactions are begun explicitly in claim()
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def claim(self, skus):
+        # Records the SKUs not issued before and returns them, in order.
+        conn = self._connect()
+        now = time.time()
+        claimed = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sku in skus:
+                if conn.execute("INSERT OR IGNORE INTO issued VALUES (?, ?)", (sku, now)).rowcount:
+                    claimed.append(sku)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return claimed
+
+    def __contains__(self, sku):
+        row = self._connect().execute("SELECT 1 FROM issued WHERE sku = ?", (sku,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM issued").fetchone()[0]
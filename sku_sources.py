@@ -0,0 +1,99 @@
+from itertools import cycle
+
+import csv
+import io
+import json
+import re
+import shutil
+import tempfile
+
+
+# Manual SKUs as lazy iterables so a large inventory export is read while
+# the labels are drawn instead of being loaded into memory first.
+
+class SkuFile:
+    # SKUs from an uploaded newline-delimited text or CSV file. Every pass
+    # re-reads the file from the start, so the stream must be seekable (an
+    # upload spooled by werkzeug, or a local file).
+    def __init__(self, stream, fmt="text", column=None, header=True, encoding="utf-8-sig"):
+        self.stream = stream
+        self.fmt = fmt
+        self.column = column
+        self.header = header
+        self.encoding = encoding
+
+    def __iter__(self):
+        self.stream.seek(0)
+        text = io.TextIOWrapper(self.stream, encoding=self.encoding, errors="replace", newline="")
+        try:
+            if self.fmt == "csv":
+                yield from self._iter_csv(text)
+            else:
+                for line in text:
+                    for sku in re.split(r"[,\s]+", line.strip()):
+                        if sku:
+                            yield sku
+        finally:
+            text.detach()  # leave the underlying stream open for the next pass
+
+    def _iter_csv(self, text):
+        rows = csv.reader(text)
+        column = self.column
+        if self.header:
+            names = [name.strip() for name in next(rows, [])]
+            if column is not None and not isinstance(column, int) and not column.isdigit():
+                if column not in names:
+                    raise ValueError(f"CSV has no column {column!r}; columns are {names}")
+                column = names.index(column)
+        column = int(column or 0)
+        for row in rows:
+            if len(row) > column and row[column].strip():
+                yield row[column].strip()
+
+    def spool(self):
+        # copy into a private temp file, for use after the request has ended
+        copy = tempfile.TemporaryFile()
+        self.stream.seek(0)
+        shutil.copyfileobj(self.stream, copy)
+        return SkuFile(copy, self.fmt, self.column, self.header, self.encoding)
+
+    def close(self):
+        self.stream.close()
+
+
+class SkuLines:
+    # SKUs spooled to a file one JSON string per line (a shard's share of a
+    # job), so they keep any commas or spaces. Read again on every pass.
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def write_sku_lines(f, skus):
+    # the other side of SkuLines; f is a text file
+    for sku in skus:
+        f.write(json.dumps(sku) + "\n")
+
+
+def repeat_to(skus, count, repeat):
+    # Yields exactly count SKUs from skus, starting over when it runs out if
+    # repeat is set. Re-iterable sources (lists, SkuFile) are simply read
+    # again; one-shot iterators have to be buffered to be repeated.
+    if repeat and iter(skus) is skus:
+        skus = cycle(skus)
+    produced = 0
+    while produced < count:
+        start = produced
+        for sku in skus:
+            yield sku
+            produced += 1
+            if produced == count:
+                return
+        if produced == start:
+            raise ValueError("Manual SKU list is empty.")
+        if not repeat:
+            raise ValueError("Manual SKU list is shorter than label count and repeat_skus is false.")
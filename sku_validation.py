@@ -0,0 +1,115 @@
+from vector_barcodes import CODE39_PATTERNS, check_digit, upce_to_upca
+
+
+# Checks manual SKUs against their symbology in one pass before anything is
+# rendered, so a bad row is reported up front (with every other bad row)
+# instead of failing inside treepoem halfway through a long job.
+# SKUs are checked as printed, prefix and suffix included.
+
+# digits before the check digit; the check digit itself is optional
+CHECK_DIGIT_LENGTHS = {"ean13": 12, "ean8": 7, "upca": 11, "upce": 7}
+
+# byte mode capacity of the largest symbol (QR at error correction M)
+QR_MAX_BYTES = 2331
+DATAMATRIX_MAX_BYTES = 1556
+
+MAX_REPORTED_ERRORS = 1000
+
+
+class SkuValidationError(ValueError):
+    def __init__(self, errors, error_count=None):
+        self.errors = errors
+        self.error_count = len(errors) if error_count is None else error_count
+        first = errors[0]
+        sku = f" ('{first['sku']}')" if first["sku"] else ""
+        super().__init__(f"{self.error_count} invalid SKU(s); first at row {first['row']}{sku}: {first['error']}")
+
+
+def expected_check_digit(sku, barcode_type):
+    if barcode_type == "upce":
+        return check_digit(upce_to_upca(sku[:7]))
+    return check_digit(sku[:CHECK_DIGIT_LENGTHS[barcode_type]])
+
+
+def sku_error(sku, barcode_type):
+    # what is wrong with sku for barcode_type, or None
+    if barcode_type in CHECK_DIGIT_LENGTHS:
+        length = CHECK_DIGIT_LENGTHS[barcode_type]
+        if not sku.isdigit():
+            return "must contain digits only"
+        if len(sku) not in (length, length + 1):
+            return f"must be {length} digits, or {length + 1} with the check digit"
+        if barcode_type == "upce" and sku[0] not in "01":
+            return "number system digit must be 0 or 1"
+        if len(sku) == length + 1:
+            expected = expected_check_digit(sku, barcode_type)
+            if sku[-1] != expected:
+                return f"check digit is {sku[-1]}, expected {expected}"
+    elif barcode_type == "code39":
+        bad = sorted({ch for ch in sku if ch not in CODE39_PATTERNS or ch == "*"})
+        if bad:
+            return f"characters not in Code 39: {''.join(bad)!r}"
+    elif barcode_type == "interleaved2of5":
+        if not sku.isdigit():
+            return "must contain digits only"
+    elif barcode_type == "code128":
+        if not sku.isascii():
+            return "must contain ASCII characters only"
+    elif barcode_type == "qrcode":
+        if len(sku.encode("utf-8")) > QR_MAX_BYTES:
+            return f"longer than {QR_MAX_BYTES} bytes"
+    elif barcode_type == "datamatrix":
+        if len(sku.encode("utf-8")) > DATAMATRIX_MAX_BYTES:
+            return f"longer than {DATAMATRIX_MAX_BYTES} bytes"
+    return None
+
+
+def fix_check_digit(sku, barcode_type):
+    # adds a missing check digit and replaces a wrong one; anything else is
+    # left for sku_error to report
+    length = CHECK_DIGIT_LENGTHS.get(barcode_type)
+    if length and sku.isdigit() and len(sku) in (length, length + 1):
+        return sku[:length] + expected_check_digit(sku, barcode_type)
+    return sku
+
+
+def with_check_digits(skus, barcode_type, prefix="", suffix=""):
+    # full SKUs (prefix and suffix included) with fix_check_digit applied
+    for sku in skus:
+        yield fix_check_digit(f"{prefix}{sku}{suffix}", barcode_type)
+
+
+def find_sku_errors(skus, barcode_type, prefix="", suffix="", fix_check_digits=False,
+                    max_errors=MAX_REPORTED_ERRORS, label_count=None):
+    # Returns (errors, error_count): one {"row", "sku", "error"} per bad
+    # row (1-based), up to max_errors, and how many rows were bad in all.
+    # label_count: rows the list must have, when it isn't repeated; a
+    # shorter (or empty) list is reported as one more error.
+    errors = []
+    error_count = 0
+    row = 0
+    for row, raw_sku in enumerate(skus, start=1):
+        sku = f"{prefix}{raw_sku}{suffix}"
+        if fix_check_digits:
+            sku = fix_check_digit(sku, barcode_type)
+        error = sku_error(sku, barcode_type)
+        if error:
+            error_count += 1
+            if len(errors) < max_errors:
+                errors.append({"row": row, "sku": sku, "error": error})
+    if row == 0:
+        error = "manual SKU list is empty"
+    elif label_count is not None and row < label_count:
+        error = f"manual SKU list ends after {row} SKUs but {label_count} labels are needed and repeat_skus is false"
+    else:
+        return errors, error_count
+    errors.append({"row": row + 1, "sku": "", "error": error})
+    return errors, error_count + 1
+
+
+def check_skus(skus, barcode_type, prefix="", suffix="", fix_check_digits=False, label_count=None):
+    errors, error_count = find_sku_errors(
+        skus, barcode_type, prefix, suffix, fix_check_digits, label_count=label_count
+    )
+    if errors:
+        raise SkuValidationError(errors, error_count)
@@ -0,0 +1,149 @@
+from collections import namedtuple
+from importlib import import_module
+from sku_validation import sku_error
+
+import io
+
+
+# Barcode types and the library that draws each of them. Importing this
+# module loads none of qrcode, pystrich or treepoem: a backend imports its
+# library the first time a symbol of that type is built, so a server that
+# only ever prints QR codes never loads treepoem. warm_up() loads (and
+# primes) them ahead of time.
+#
+# modules: what the backend imports, for warm_up(). DataMatrix also
+#   needs pystrich for stacked layouts.
+# make(sku, barcode_type, raw): the raster symbol; raw is the treepoem image
+#   for this SKU if a batch already rendered it.
+# treepoem: rendered through treepoem/BWIPP (and so batchable by
+#   batch_render), with options passed to BWIPP.
+
+Backend = namedtuple("Backend", "modules make treepoem options", defaults=(False, None))
+
+QRCODE_MODULES = ("PIL.Image", "qrcode")
+TREEPOEM_MODULES = ("PIL.Image", "treepoem", "batch_render")
+
+
+def is_valid_barcode(sku: str, barcode_type: str) -> bool:
+    return sku_error(sku, barcode_type) is None
+
+
+def render_treepoem(sku, barcode_type):
+    from batch_render import render_barcodes
+    return render_barcodes([treepoem_job(sku, barcode_type)])[0]
+
+
+def _make_qrcode(sku, barcode_type, raw=None):
+    import qrcode
+    return qrcode.make(sku).get_image().convert("RGB")
+
+
+def _make_treepoem_1bit(sku, barcode_type, raw=None):
+    if raw is None:
+        raw = render_treepoem(sku, barcode_type)
+    return raw.convert("1")
+
+
+def _make_treepoem(sku, barcode_type, raw=None):
+    # any other BWIPP type, passed through as is
+    if not is_valid_barcode(sku, barcode_type):
+        raise ValueError(f"Invalid input '{sku}' for barcode type '{barcode_type}'")
+
+    try:
+        if raw is None:
+            raw = render_treepoem(sku, barcode_type)
+        return raw.convert("RGB")
+    except Exception as e:
+        raise RuntimeError(f"Failed to generate barcode {barcode_type} for {sku}: {e}")
+
+
+def _zint(symbology):
+    return Backend(TREEPOEM_MODULES, _make_treepoem_1bit, True, {"symbology": str(symbology)})
+
+
+BACKENDS = {
+    "code39": _zint(1),
+    "upce": _zint(9),
+    "interleaved2of5": _zint(6),
+    "datamatrix": _zint(50)._replace(modules=TREEPOEM_MODULES + ("pystrich.datamatrix",)),
+    "ean13": _zint(13),
+    "ean8": _zint(14),
+    "upca": _zint(34),
+    "qrcode": Backend(QRCODE_MODULES, _make_qrcode),
+    "code128": Backend(TREEPOEM_MODULES, _make_treepoem_1bit, True),
+    "none": Backend((), None),
+}
+
+OTHER_BACKEND = Backend(TREEPOEM_MODULES, _make_treepoem, True)
+
+
+def get_backend(barcode_type):
+    return BACKENDS.get(barcode_type, OTHER_BACKEND)
+
+
+def barcode_types():
+    return [barcode_type for barcode_type in BACKENDS if barcode_type != "none"]
+
+
+def treepoem_job(sku, barcode_type):
+    # The (barcode_type, data, options) job draw_barcode renders through
+    # treepoem/BWIPP for this SKU, or None if it is drawn another way.
+    backend = get_backend(barcode_type)
+    if not backend.treepoem:
+        return None
+    return (barcode_type, sku, backend.options)
+
+
+def make_barcode(sku, barcode_type, raw=None):
+    return get_backend(barcode_type).make(sku, barcode_type, raw)
+
+
+# Stacked-layout QR/DataMatrix, built at their final pixel size.
+
+def make_scaled_qr(data, target_px, box_size=10, border=1):
+    from PIL import Image
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=None,  # automatically choose best fit
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,  # size of each box (in pixels)
+        border=border  # white space around edges
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white").convert("1")
+    return img.resize((target_px, target_px), Image.LANCZOS)
+
+
+def make_scaled_datamatrix(data, target_px, scale=10):
+    from PIL import Image
+    from pystrich.datamatrix import DataMatrixEncoder
+
+    encoder = DataMatrixEncoder(data)
+    # in-memory PNG, same bytes encoder.save() writes; no shared temp file
+    png = io.BytesIO(encoder.get_imagedata())
+
+    img = Image.open(png).convert("RGB")  # Read it as PIL image
+    width, height = img.size
+    img = img.resize((width * scale, height * scale), Image.NEAREST)
+    return img.resize((target_px, target_px), Image.LANCZOS)
+
+
+def warm_up(types=None):
+    # Imports the backends of these barcode types (default: all) and does
+    # the one-off work of their first symbol: BWIPP is read in, and QR and
+    # DataMatrix build their lookup tables. Call it in a server's master
+    # process before workers fork, so they share it instead of each paying
+    # for it on its first request.
+    backends = [get_backend(barcode_type) for barcode_type in (types or barcode_types())]
+    modules = {module for backend in backends for module in backend.modules}
+    for module in sorted(modules):
+        import_module(module)
+    if "treepoem" in modules:
+        import_module("treepoem").load_bwipp()
+    if "qrcode" in modules:
+        make_scaled_qr("0", 32)
+    if "pystrich.datamatrix" in modules:
+        make_scaled_datamatrix("0", 32)
+    return sorted(modules)
@@ -0,0 +1,35 @@
+from batch_render import render_barcodes
+
+import shutil
+
+import pytest
+
+treepoem = pytest.importorskip("treepoem")
+
+pytestmark = pytest.mark.skipif(shutil.which("gs") is None, reason="Ghostscript is not installed")
+
+JOBS = [
+    ("code128", "ABC-12345", None),
+    ("qrcode", "https://example.com/12345", None),
+    ("ean13", "4006381333931", None),
+    ("datamatrix", "SKU000123", None),
+    ("code39", "CODE39", {"includetext": True}),
+]
+
+
+@pytest.mark.parametrize("scale", [1, 2])
+def test_batch_matches_generate_barcode(scale):
+    batched = render_barcodes(JOBS, scale=scale)
+    assert len(batched) == len(JOBS)
+    for (barcode_type, data, options), image in zip(JOBS, batched):
+        single = treepoem.generate_barcode(barcode_type, data, options, scale=scale)
+        assert image.size == single.size, barcode_type
+        assert image.convert("RGB").tobytes() == single.convert("RGB").tobytes(), barcode_type
+
+
+def test_chunks_keep_job_order():
+    one_session = render_barcodes(JOBS)
+    chunked = render_barcodes(JOBS, workers=2, chunk_size=2)
+    assert [image.convert("RGB").tobytes() for image in chunked] == [
+        image.convert("RGB").tobytes() for image in one_session
+    ]
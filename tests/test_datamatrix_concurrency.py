@@ -0,0 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
+from symbologies import make_scaled_datamatrix
+
+import os
+
+import pytest
+
+zxingcpp = pytest.importorskip("zxingcpp")
+pytest.importorskip("pystrich")
+
+
+def decode(img):
+    results = zxingcpp.read_barcodes(img, formats=zxingcpp.BarcodeFormat.DataMatrix)
+    return [result.text for result in results]
+
+
+def test_threads_get_their_own_symbols(tmp_path, monkeypatch):
+    # any file written per label would land here
+    monkeypatch.chdir(tmp_path)
+    skus = [f"SKU-{n:05d}" for n in range(200)]
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        images = list(pool.map(lambda sku: make_scaled_datamatrix(sku, 240), skus))
+
+    assert [decode(img) for img in images] == [[sku] for sku in skus]
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,75 @@
+from disk_lru import LruDirectory
+from document_cache import DocumentCache, document_key
+
+import os
+
+import pytest
+
+MANUAL = dict(barcode_type="code128", quantity=2, rows=2, columns=1, render_mode="vector",
+              use_manual_preview=True, sku_list=["A1", "B2", "C3", "D4"])
+
+
+def test_only_repeatable_requests_have_a_key():
+    random_skus = dict(MANUAL, use_manual_preview=False, sku_list=None)
+    assert document_key(random_skus) is None
+    assert document_key(random_skus, seed=7, sku_index=object()) is None
+    assert document_key(random_skus, seed=7) == document_key(random_skus, seed=7)
+    assert document_key(random_skus, seed=7) != document_key(random_skus, seed=8)
+
+
+def test_manual_key_covers_the_printed_skus_only():
+    key = document_key(MANUAL)
+    assert key == document_key(dict(MANUAL, sku_list=iter(MANUAL["sku_list"]), validate=False))
+    assert key == document_key(dict(MANUAL, sku_list=MANUAL["sku_list"] + ["E5"]))
+    assert key != document_key(dict(MANUAL, sku_list=["A1", "B2", "C3", "XX"]))
+    assert key != document_key(dict(MANUAL, rows=1, columns=4))
+
+
+def test_put_then_open(tmp_path):
+    cache = DocumentCache(str(tmp_path))
+    assert cache.open("k") is None
+    path = cache.temp_path(".pdf")
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4 labels")
+    cache.put("k", path)
+    with cache.open("k") as f:
+        assert f.read() == b"%PDF-1.4 labels"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["disk_bytes"]) == (1, 1, 15)
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    files = LruDirectory(str(tmp_path), ".doc", max_bytes=250)
+    for n, name in enumerate("abc"):
+        with open(files.path(name), "wb") as f:
+            f.write(b"x" * 100)
+        os.utime(files.path(name), (n, n))
+        evicted = files.added(100)
+    # c pushed it over the cap; a is the oldest
+    assert evicted == 1
+    assert sorted(os.listdir(tmp_path)) == ["b.doc", "c.doc"]
+    assert files.bytes == 200
+    # a reopened directory picks up what is already there
+    assert LruDirectory(str(tmp_path), ".doc", 250).bytes == 200
+
+
+def test_generate_answers_reprints_from_the_cache(tmp_path, monkeypatch):
+    app = pytest.importorskip("app")
+    monkeypatch.setattr(app, "document_cache", DocumentCache(str(tmp_path)))
+    client = app.app.test_client()
+    body = dict(MANUAL, sku_list="A1 B2 C3 D4")
+
+    first = client.post("/generate", json=body)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    again = client.post("/generate", json=body)
+    assert again.headers["ETag"] == etag
+    assert again.data == first.data
+    assert client.post("/generate", json=body, headers={"If-None-Match": etag}).status_code == 304
+    assert client.post("/generate", json=dict(body, sku_list="A1 B2 C3 XX")).headers["ETag"] != etag
+
+    stats = app.document_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["not_modified"]) == (1, 2, 1)
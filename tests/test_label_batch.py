@@ -0,0 +1,63 @@
+from label_batch import main, run_manifest
+
+import io
+import json
+import os
+
+
+MANIFEST = [
+    "# nightly reprint",
+    json.dumps({"name": "shelf", "barcode_type": "code128", "quantity": 2, "rows": 2, "columns": 2,
+                "render_mode": "vector", "use_manual_preview": True, "sku_list": "A1 B2 C3", "repeat_skus": True}),
+    "",
+    json.dumps({"barcode_type": "code128", "quantity": 3, "rng_length": 6, "seed": 1, "output_format": "zpl"}),
+    json.dumps({"name": "from-file", "barcode_type": "code39", "quantity": 1, "output_format": "epl",
+                "sku_file": "skus.csv", "csv_column": "sku"}),
+    json.dumps({"name": "bad", "barcode_type": "ean13", "quantity": 1, "use_manual_preview": True, "sku_list": "123"}),
+    "{not json",
+]
+
+
+def write_manifest(tmp_path):
+    (tmp_path / "skus.csv").write_text("name,sku\nbolt,BOLT-1\n", encoding="utf-8")
+    manifest = tmp_path / "jobs.jsonl"
+    manifest.write_text("\n".join(MANIFEST) + "\n", encoding="utf-8")
+    return manifest
+
+
+def test_run_manifest(tmp_path):
+    manifest = write_manifest(tmp_path)
+    out_dir = tmp_path / "labels"
+    finished = []
+    with open(manifest, encoding="utf-8") as f:
+        results = run_manifest(f, str(out_dir), workers=2, base_dir=str(tmp_path), on_result=finished.append)
+
+    assert [result["line"] for result in results] == [2, 4, 5, 6, 7]
+    assert sorted(result["line"] for result in finished) == [2, 4, 5, 6, 7]
+    assert [result["name"] for result in results] == ["shelf", "job-0004", "from-file", "bad", "job-0007"]
+    assert [result["labels"] for result in results[:3]] == [8, 3, 1]
+    assert all(result["error"] is None for result in results[:3])
+    assert results[3]["error"].startswith("SkuValidationError")
+    assert results[4]["error"].startswith("JSONDecodeError")
+    assert sorted(os.listdir(out_dir)) == ["from-file.epl", "job-0004.zpl", "shelf.pdf"]
+    assert b'"BOLT-1"' in (out_dir / "from-file.epl").read_bytes()
+
+
+def test_seeded_jobs_are_repeatable(tmp_path):
+    line = json.dumps({"name": "seeded", "barcode_type": "code128", "quantity": 2, "rng_length": 8,
+                       "seed": 42, "output_format": "zpl"})
+    runs = []
+    for n in range(2):
+        out_dir = tmp_path / str(n)
+        run_manifest(io.StringIO(line), str(out_dir))
+        runs.append((out_dir / "seeded.zpl").read_bytes())
+    assert runs[0] == runs[1]
+
+
+def test_main_exits_1_when_a_job_fails(tmp_path, capsys):
+    manifest = write_manifest(tmp_path)
+    summary = tmp_path / "summary.json"
+    assert main([str(manifest), "--out-dir", str(tmp_path / "labels"), "--summary", str(summary)]) == 1
+    out = capsys.readouterr().out
+    assert "5 jobs, 2 failed; 12 labels" in out
+    assert len(json.loads(summary.read_text(encoding="utf-8"))["jobs"]) == 5
@@ -0,0 +1,75 @@
+from generator import generate_labels
+from PIL import Image
+
+import io
+
+import pytest
+
+SKUS = ["ABC-123", "XYZ-9"]
+LABEL = dict(barcode_type="code128", rng_length=6, quantity=2, label_width=3, label_height=2, dpi=203,
+             barcode_size=60, text_size=12, use_manual_preview=True, sku_list=SKUS)
+
+ZPL = (
+    "^XA^CI28^PW609^LL406^LH0,0\n"
+    "^FO136,125^BY3,3.0,90^BCN,90,N,N,N,A^FH^FDABC-123^FS\n"
+    "^FT0,114^A0N,51,51^FB608,1,0,C^FH^FDABC-123^FS\n"
+    "^XZ\n"
+    "^XA^CI28^PW609^LL406^LH0,0\n"
+    "^FO124,125^BY4,3.0,90^BCN,90,N,N,N,A^FH^FDXYZ-9^FS\n"
+    "^FT0,114^A0N,51,51^FB608,1,0,C^FH^FDXYZ-9^FS\n"
+    "^XZ\n"
+)
+
+EPL = (
+    "\nq609\nQ406,24\n"
+    "N\n"
+    'B136,125,0,1,3,9,90,N,"ABC-123"\n'
+    'A164,78,0,1,4,4,N,"ABC-123"\n'
+    "P1\n"
+    "N\n"
+    'B124,125,0,1,4,12,90,N,"XYZ-9"\n'
+    'A204,78,0,1,4,4,N,"XYZ-9"\n'
+    "P1\n"
+)
+
+PNG_END = b"IEND\xaeB`\x82"
+
+
+def render(output_format, **options):
+    out = io.BytesIO()
+    generate_labels(output_path=out, output_format=output_format, **dict(LABEL, **options))
+    return out.getvalue()
+
+
+def png_pages(data):
+    # PngLabels writes one complete PNG per page, back to back
+    chunks = data.split(PNG_END)
+    assert chunks[-1] == b""
+    return [Image.open(io.BytesIO(chunk + PNG_END)) for chunk in chunks[:-1]]
+
+
+def tiff_pages(data):
+    tiff = Image.open(io.BytesIO(data))
+    pages = []
+    for n in range(tiff.n_frames):
+        tiff.seek(n)
+        pages.append(tiff.copy())
+    return pages
+
+
+def decode(page):
+    zxingcpp = pytest.importorskip("zxingcpp")
+    return [result.text for result in zxingcpp.read_barcodes(page.convert("L"))]
+
+
+@pytest.mark.parametrize("output_format, expected", [("zpl", ZPL), ("epl", EPL)])
+def test_printer_language_output(output_format, expected):
+    assert render(output_format).decode("utf-8") == expected
+
+
+@pytest.mark.parametrize("output_format, pages", [("png", png_pages), ("tiff", tiff_pages)])
+@pytest.mark.parametrize("barcode_type", ["code128", "qrcode"])
+def test_bitmap_pages_decode(output_format, pages, barcode_type):
+    images = pages(render(output_format, barcode_type=barcode_type, dpi=300))
+    assert [image.size for image in images] == [(900, 600)] * len(SKUS)
+    assert [decode(image) for image in images] == [[sku] for sku in SKUS]
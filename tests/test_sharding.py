@@ -0,0 +1,65 @@
+from generator import generate_labels
+from PIL import Image
+from sharding import CommandShardWorkers, ProcessShardWorkers, render_sharded, shard_pages, shard_specs
+from sku_sources import SkuFile, SkuLines
+
+import io
+import json
+import random
+
+import pytest
+
+RANDOM = dict(barcode_type="code128", quantity=5, rng_length=6, rows=2, columns=1)
+# commas and spaces survive the trip through the shards' SKU files
+CSV = "sku\n" + "".join(f'"A,{n} x"\n' for n in range(7))
+MANUAL = dict(RANDOM, quantity=7, use_manual_preview=True, repeat_skus=True)
+
+
+def manual_skus():
+    return SkuFile(io.BytesIO(CSV.encode("utf-8")), "csv")
+
+
+@pytest.fixture(params=["process", "command"])
+def workers(request):
+    workers = ProcessShardWorkers(2) if request.param == "process" else CommandShardWorkers(2)
+    yield workers
+    workers.shutdown()
+
+
+def test_shard_pages():
+    assert shard_pages(7, 3) == [(0, 3), (3, 5), (5, 7)]
+    assert shard_pages(2, 5) == [(0, 1), (1, 2)]
+
+
+def test_manual_shards_get_only_their_rows(tmp_path):
+    specs = shard_specs(dict(MANUAL, sku_list=manual_skus()), 3, str(tmp_path))
+    assert [spec["pages"] for spec in specs] == [[0, 3], [3, 5], [5, 7]]
+    assert [spec["options"]["quantity"] for spec in specs] == [3, 2, 2]
+    rows = [list(SkuLines(spec["sku_path"])) for spec in specs]
+    expected = [f"A,{n % 7} x" for n in range(14)]
+    assert rows == [expected[:6], expected[6:10], expected[10:]]
+    json.dumps(specs)
+
+
+@pytest.mark.parametrize("output_format", ["zpl", "epl"])
+def test_sharded_printer_labels_match_a_single_render(tmp_path, workers, output_format):
+    for options in (dict(RANDOM, rng=random.Random(3)), dict(MANUAL, sku_list=manual_skus())):
+        single = generate_labels(output_path=str(tmp_path / "single"), output_format=output_format,
+                                 **dict(options, rng=random.Random(3)))
+        sharded = render_sharded(output_path=str(tmp_path / "sharded"), shards=3, workers=workers,
+                                 output_format=output_format, **options)
+        with open(single, "rb") as a, open(sharded, "rb") as b:
+            assert a.read() == b.read()
+
+
+def test_sharded_tiff_keeps_every_page(tmp_path, workers):
+    single = generate_labels(output_path=str(tmp_path / "single.tiff"), output_format="tiff", dpi=100,
+                             rng=random.Random(5), **RANDOM)
+    sharded = render_sharded(output_path=str(tmp_path / "sharded.tiff"), shards=2, workers=workers,
+                             output_format="tiff", dpi=100, rng=random.Random(5), **RANDOM)
+    with Image.open(single) as a, Image.open(sharded) as b:
+        assert a.n_frames == b.n_frames == RANDOM["quantity"]
+        for n in range(a.n_frames):
+            a.seek(n)
+            b.seek(n)
+            assert a.convert("1").tobytes() == b.convert("1").tobytes()
@@ -0,0 +1,46 @@
+from generator import generate_labels
+from sku_validation import SkuValidationError, check_skus, find_sku_errors, with_check_digits
+
+import pytest
+
+
+def test_every_bad_row_is_reported():
+    skus = ["4006381333931", "40063813339", "4006381333932", "ABC", "012345678905"]
+    errors, error_count = find_sku_errors(skus, "ean13")
+    assert error_count == 3
+    assert errors == [
+        {"row": 2, "sku": "40063813339", "error": "must be 12 digits, or 13 with the check digit"},
+        {"row": 3, "sku": "4006381333932", "error": "check digit is 2, expected 1"},
+        {"row": 4, "sku": "ABC", "error": "must contain digits only"},
+    ]
+
+
+def test_rows_are_checked_as_printed():
+    assert find_sku_errors(["638133393"], "ean13", prefix="400") == ([], 0)
+    assert find_sku_errors(["4006381333932"], "ean13", fix_check_digits=True) == ([], 0)
+    assert list(with_check_digits(["400638133393", "4006381333932"], "ean13")) == ["4006381333931"] * 2
+
+
+def test_reported_errors_are_capped_but_counted():
+    errors, error_count = find_sku_errors(["é"] * 50, "code128", max_errors=10)
+    assert len(errors) == 10
+    assert error_count == 50
+
+
+def test_short_and_empty_lists():
+    errors, error_count = find_sku_errors(["A", "B"], "code128", label_count=5)
+    assert error_count == 1
+    assert errors[0]["row"] == 3 and errors[0]["sku"] == ""
+    assert find_sku_errors(["A", "B"], "code128", label_count=2) == ([], 0)
+    with pytest.raises(SkuValidationError, match="empty"):
+        check_skus([], "code128")
+
+
+def test_generate_labels_fails_before_writing(tmp_path):
+    output = tmp_path / "labels.pdf"
+    with pytest.raises(SkuValidationError) as failure:
+        generate_labels("code39", 4, 6, output_path=str(output), use_manual_preview=True,
+                        sku_list=["GOOD", "bad", "OK", "x#"], render_mode="vector")
+    assert failure.value.error_count == 2
+    assert [error["row"] for error in failure.value.errors] == [2, 4]
+    assert not output.exists()
@@ -0,0 +1,17 @@
+from benchmark import STARTUP_MODULES, measure_startup
+
+import os
+
+# median cold import of each module in a fresh interpreter; about 200 ms
+# on a developer laptop, so this only trips on a real regression
+IMPORT_BUDGET_MS = 1000
+
+
+def test_cold_imports_load_no_backends_and_stay_in_budget(monkeypatch):
+    # the child interpreters import the repo's modules from the working directory
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    startup = measure_startup(STARTUP_MODULES, runs=3)
+
+    for module in STARTUP_MODULES:
+        assert startup[module]["backends_loaded"] == [], module
+        assert startup[module]["import_ms"] < IMPORT_BUDGET_MS, module
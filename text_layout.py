@@ -0,0 +1,66 @@
+from functools import lru_cache
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+
+# Text fitted to a box by real glyph widths. Widths come from a per-font
+# table (units of 1/1000 em, filled for Latin-1 up front and for anything
+# else on first use), so a line is measured by adding up its characters
+# once instead of re-measuring a growing string for every character.
+
+ELLIPSIS = "..."
+
+
+@lru_cache(maxsize=None)
+def glyph_widths(font_name):
+    return {chr(code): stringWidth(chr(code), font_name, 1000) for code in range(32, 256)}
+
+
+def _char_width(widths, font_name, char):
+    width = widths.get(char)
+    if width is None:
+        width = widths[char] = stringWidth(char, font_name, 1000)
+    return width
+
+
+@lru_cache(maxsize=8192)
+def wrap_lines(text, font_name, font_size, max_width, max_lines):
+    # Greedy fill: each line takes characters until the next one would
+    # pass max_width (every line gets at least one). Text that needs more
+    # than max_lines has its last line cut to end in an ellipsis.
+    # Returns ((line, width_in_points), ...).
+    widths = glyph_widths(font_name)
+    limit = max_width * 1000 / font_size
+    lines = []
+    start = 0
+    line_width = 0
+    overflow = False
+    for i, char in enumerate(text):
+        width = _char_width(widths, font_name, char)
+        if line_width + width > limit and i > start:
+            lines.append((start, i, line_width))
+            start = i
+            line_width = 0
+            if len(lines) == max_lines:
+                overflow = True
+                break
+        line_width += width
+    if not overflow and start < len(text):
+        lines.append((start, len(text), line_width))
+
+    scale = font_size / 1000
+    result = [(text[a:b], w * scale) for a, b, w in lines]
+    if overflow:
+        a, b, w = lines[-1]
+        ellipsis_width = sum(_char_width(widths, font_name, char) for char in ELLIPSIS)
+        while b > a and w + ellipsis_width > limit:
+            b -= 1
+            w -= _char_width(widths, font_name, text[b])
+        result[-1] = (text[a:b] + ELLIPSIS, (w + ellipsis_width) * scale)
+    return tuple(result)
+
+
+def line_baselines(count, center_y, font_size):
+    # baselines of count lines centred on center_y, top line first
+    total_text_height = count * font_size * 1.1
+    start_y = center_y + total_text_height / 2 - font_size
+    return [start_y - i * font_size * 1.1 for i in range(count)]
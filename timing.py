@@ -0,0 +1,117 @@
+from collections import defaultdict
+
+import threading
+import time
+
+
+# Per-stage timing for generate_labels. A StageTimer is only created when
+# timing is on; generate_labels then wraps its stage functions with
+# timer.timed(), so a run without a timer executes the plain functions.
+#
+# Stages nest (a barcode image is built while a label is being drawn), and
+# time is charged to the innermost running stage only, so the stage totals
+# add up to the time spent inside any stage.
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._stack = []
+        self._mark = 0.0
+
+    def start(self, stage):
+        now = time.perf_counter()
+        if self._stack:
+            self.seconds[self._stack[-1]] += now - self._mark
+        self._stack.append(stage)
+        self.calls[stage] += 1
+        self._mark = now
+
+    def stop(self):
+        now = time.perf_counter()
+        self.seconds[self._stack.pop()] += now - self._mark
+        self._mark = now
+
+    def timed(self, stage, func):
+        def timed_call(*args, **kwargs):
+            self.start(stage)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.stop()
+        return timed_call
+
+    def timed_iter(self, stage, iterable):
+        # for lazy sources: time spent producing each item
+        items = iter(iterable)
+        while True:
+            self.start(stage)
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                self.stop()
+            yield item
+
+    def totals(self):
+        # JSON-safe stage totals, e.g. to send back from a shard process
+        return {"seconds": dict(self.seconds), "calls": dict(self.calls)}
+
+    def add(self, totals):
+        # stage totals of work timed elsewhere (see totals())
+        for stage, seconds in totals["seconds"].items():
+            self.seconds[stage] += seconds
+        for stage, calls in totals["calls"].items():
+            self.calls[stage] += calls
+
+    def server_timing(self):
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.seconds.items())
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class StageMetrics:
+    # Totals over all timed runs, by stage, barcode type and layout mode.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.runs = defaultdict(int)
+        self.labels = defaultdict(int)
+        self.pages = defaultdict(int)
+
+    def record(self, timer, barcode_type, layout_mode, labels, pages):
+        run = (barcode_type, layout_mode)
+        with self._lock:
+            for stage, seconds in timer.seconds.items():
+                self.seconds[(stage,) + run] += seconds
+                self.calls[(stage,) + run] += timer.calls[stage]
+            self.runs[run] += 1
+            self.labels[run] += labels
+            self.pages[run] += pages
+
+    def prometheus(self):
+        with self._lock:
+            lines = []
+            stage_labels = ("stage", "barcode_type", "layout_mode")
+            run_labels = ("barcode_type", "layout_mode")
+            for name, help_text, values, label_names in (
+                ("label_stage_seconds_total", "Time spent in each generate_labels stage.", self.seconds, stage_labels),
+                ("label_stage_calls_total", "Calls of each generate_labels stage.", self.calls, stage_labels),
+                ("label_runs_total", "Timed generate_labels runs.", self.runs, run_labels),
+                ("label_labels_total", "Labels drawn by timed runs.", self.labels, run_labels),
+                ("label_pages_total", "Pages written by timed runs.", self.pages, run_labels),
+            ):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(values.items()):
+                    labels = ",".join(f'{label}="{_escape(part)}"' for label, part in zip(label_names, key))
+                    value_text = str(value) if isinstance(value, int) else f"{value:.6f}"
+                    lines.append(f"{name}{{{labels}}} {value_text}")
+            return "\n".join(lines) + "\n"
+
+
+stage_metrics = StageMetrics()
@@ -0,0 +1,307 @@
+import string
+
+
+# Module patterns for the 1D symbologies (pure Python) and module matrices
+# for QR/DataMatrix, so they can be drawn as PDF rectangles instead of going
+# through treepoem/PIL and a bitmap.
+# encode_modules() returns a string of "1" (bar) and "0" (space) modules,
+# starting and ending on a bar like the cropped treepoem images.
+
+VECTOR_BARCODES = {
+    "code128",
+    "code39",
+    "ean13",
+    "ean8",
+    "upca",
+    "upce",
+    "interleaved2of5",
+}
+
+VECTOR_2D_BARCODES = {"qrcode", "datamatrix"}
+
+WIDE = 3  # wide:narrow ratio for code39 and interleaved2of5
+
+
+CODE128_PATTERNS = [
+    "212222", "222122", "222221", "121223", "121322", "131222", "122213", "122312", "132212", "221213",
+    "221312", "231212", "112232", "122132", "122231", "113222", "123122", "123221", "223211", "221132",
+    "221231", "213212", "223112", "312131", "311222", "321122", "321221", "312212", "322112", "322211",
+    "212123", "212321", "232121", "111323", "131123", "131321", "112313", "132113", "132311", "211313",
+    "231113", "231311", "112133", "112331", "132131", "113123", "113321", "133121", "313121", "211331",
+    "231131", "213113", "213311", "213131", "311123", "311321", "331121", "312113", "312311", "332111",
+    "314111", "221411", "431111", "111224", "111422", "121124", "121421", "141122", "141221", "112214",
+    "112412", "122114", "122411", "142112", "142211", "241211", "221114", "413111", "241112", "134111",
+    "111242", "121142", "121241", "114212", "124112", "124211", "411212", "421112", "421211", "212141",
+    "214121", "412121", "111143", "111341", "131141", "114113", "114311", "411113", "411311", "113141",
+    "114131", "311141", "411131", "211412", "211214", "211232", "2331112",
+]
+CODE128_START = {"A": 103, "B": 104, "C": 105}
+CODE128_SWITCH = {"A": 101, "B": 100, "C": 99}
+
+CODE39_PATTERNS = {
+    "0": "000110100", "1": "100100001", "2": "001100001", "3": "101100000", "4": "000110001",
+    "5": "100110000", "6": "001110000", "7": "000100101", "8": "100100100", "9": "001100100",
+    "A": "100001001", "B": "001001001", "C": "101001000", "D": "000011001", "E": "100011000",
+    "F": "001011000", "G": "000001101", "H": "100001100", "I": "001001100", "J": "000011100",
+    "K": "100000011", "L": "001000011", "M": "101000010", "N": "000010011", "O": "100010010",
+    "P": "001010010", "Q": "000000111", "R": "100000110", "S": "001000110", "T": "000010110",
+    "U": "110000001", "V": "011000001", "W": "111000000", "X": "010010001", "Y": "110010000",
+    "Z": "011010000", "-": "010000101", ".": "110000100", " ": "011000100", "*": "010010100",
+    "$": "010101000", "/": "010100010", "+": "010001010", "%": "000101010",
+}
+
+EAN_L = ["0001101", "0011001", "0010011", "0111101", "0100011",
+         "0110001", "0101111", "0111011", "0110111", "0001011"]
+EAN_R = ["".join("1" if m == "0" else "0" for m in code) for code in EAN_L]
+EAN_G = [code[::-1] for code in EAN_R]
+EAN13_PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG",
+                "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+UPCE_PARITY = ["GGGLLL", "GGLGLL", "GGLLGL", "GGLLLG", "GLGGLL",
+               "GLLGGL", "GLLLGG", "GLGLGL", "GLGLLG", "GLLGLG"]
+
+I2OF5_PATTERNS = ["00110", "10001", "01001", "11000", "00101",
+                  "10100", "01100", "00011", "10010", "01010"]
+
+
+def widths_to_modules(widths):
+    # "212222" -> bar of 2, space of 1, bar of 2, ...
+    return "".join(("1" if i % 2 == 0 else "0") * int(w) for i, w in enumerate(widths))
+
+
+def wide_narrow_to_widths(pattern):
+    return "".join(str(WIDE) if flag == "1" else "1" for flag in pattern)
+
+
+def check_digit(digits: str) -> str:
+    # GS1 mod-10: weight 3 on every other digit, starting from the right
+    total = sum(int(d) * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(digits)))
+    return str((10 - total % 10) % 10)
+
+
+def _digits_with_check(data, barcode_type, length):
+    if not data.isdigit() or len(data) not in (length, length + 1):
+        raise ValueError(f"Invalid input '{data}' for barcode type '{barcode_type}'")
+    check = check_digit(data[:length])
+    if len(data) == length + 1 and data[-1] != check:
+        raise ValueError(f"Bad check digit in '{data}' for barcode type '{barcode_type}'")
+    return data[:length] + check
+
+
+def _digit_run(data, i):
+    end = i
+    while end < len(data) and data[end] in string.digits:
+        end += 1
+    return end - i
+
+
+def code128_values(data):
+    values = []
+    code_set = None
+
+    def switch(new_set):
+        nonlocal code_set
+        if code_set is None:
+            values.append(CODE128_START[new_set])
+        elif code_set != new_set:
+            values.append(CODE128_SWITCH[new_set])
+        code_set = new_set
+
+    i = 0
+    while i < len(data):
+        run = _digit_run(data, i)
+        if run >= 4:
+            if run % 2:
+                # odd run: one digit in A/B, the even remainder in C
+                switch(code_set if code_set in ("A", "B") else "B")
+                values.append(ord(data[i]) - 32)
+                i += 1
+                run -= 1
+            switch("C")
+            for j in range(i, i + run, 2):
+                values.append(int(data[j:j + 2]))
+            i += run
+            continue
+
+        ch = ord(data[i])
+        if ch > 127:
+            raise ValueError(f"Invalid input '{data}' for barcode type 'code128'")
+        if ch < 32:
+            switch("A")
+        elif ch >= 96:
+            switch("B")
+        elif code_set not in ("A", "B"):
+            switch("B")
+        values.append(ch + 64 if ch < 32 else ch - 32)
+        i += 1
+
+    checksum = values[0] + sum(pos * value for pos, value in enumerate(values[1:], start=1))
+    return values + [checksum % 103, 106]
+
+
+def encode_code128(data):
+    return "".join(widths_to_modules(CODE128_PATTERNS[v]) for v in code128_values(data))
+
+
+def encode_code39(data):
+    data = data.upper()
+    if "*" in data or any(ch not in CODE39_PATTERNS for ch in data):
+        raise ValueError(f"Invalid input '{data}' for barcode type 'code39'")
+    gap = "0"  # one narrow space between characters
+    return gap.join(
+        widths_to_modules(wide_narrow_to_widths(CODE39_PATTERNS[ch])) for ch in f"*{data}*"
+    )
+
+
+def encode_ean13(data, barcode_type="ean13"):
+    digits = _digits_with_check(data, barcode_type, 12)
+    parity = EAN13_PARITY[int(digits[0])]
+    left = "".join((EAN_L if p == "L" else EAN_G)[int(d)] for p, d in zip(parity, digits[1:7]))
+    right = "".join(EAN_R[int(d)] for d in digits[7:])
+    return f"101{left}01010{right}101"
+
+
+def encode_upca(data):
+    digits = _digits_with_check(data, "upca", 11)
+    # UPC-A is EAN-13 with a leading zero
+    return encode_ean13("0" + digits)
+
+
+def encode_ean8(data):
+    digits = _digits_with_check(data, "ean8", 7)
+    left = "".join(EAN_L[int(d)] for d in digits[:4])
+    right = "".join(EAN_R[int(d)] for d in digits[4:])
+    return f"101{left}01010{right}101"
+
+
+def upce_to_upca(digits):
+    ns, x = digits[0], digits[1:7]
+    last = x[5]
+    if last in "012":
+        body = f"{x[0]}{x[1]}{last}0000{x[2]}{x[3]}{x[4]}"
+    elif last == "3":
+        body = f"{x[0]}{x[1]}{x[2]}00000{x[3]}{x[4]}"
+    elif last == "4":
+        body = f"{x[0]}{x[1]}{x[2]}{x[3]}00000{x[4]}"
+    else:
+        body = f"{x[0]}{x[1]}{x[2]}{x[3]}{x[4]}0000{last}"
+    return ns + body
+
+
+def encode_upce(data):
+    if not data.isdigit() or len(data) not in (7, 8) or data[0] not in "01":
+        raise ValueError(f"Invalid input '{data}' for barcode type 'upce'")
+    check = check_digit(upce_to_upca(data[:7]))
+    if len(data) == 8 and data[-1] != check:
+        raise ValueError(f"Bad check digit in '{data}' for barcode type 'upce'")
+    parity = UPCE_PARITY[int(check)]
+    if data[0] == "1":
+        parity = parity.translate(str.maketrans("LG", "GL"))
+    body = "".join((EAN_L if p == "L" else EAN_G)[int(d)] for p, d in zip(parity, data[1:7]))
+    return f"101{body}010101"
+
+
+def encode_interleaved2of5(data):
+    if not data.isdigit():
+        raise ValueError(f"Invalid input '{data}' for barcode type 'interleaved2of5'")
+    if len(data) % 2:
+        data = "0" + data
+    modules = "1010"
+    for i in range(0, len(data), 2):
+        bars = I2OF5_PATTERNS[int(data[i])]
+        spaces = I2OF5_PATTERNS[int(data[i + 1])]
+        widths = "".join(
+            wide_narrow_to_widths(b) + wide_narrow_to_widths(s) for b, s in zip(bars, spaces)
+        )
+        modules += widths_to_modules(widths)
+    return modules + "1" * WIDE + "01"
+
+
+ENCODERS = {
+    "code128": encode_code128,
+    "code39": encode_code39,
+    "ean13": encode_ean13,
+    "ean8": encode_ean8,
+    "upca": encode_upca,
+    "upce": encode_upce,
+    "interleaved2of5": encode_interleaved2of5,
+}
+
+
+def encode_modules(barcode_type, data):
+    return ENCODERS[barcode_type](data)
+
+
+def draw_modules(c, modules, x, y, width, height):
+    # one rectangle per run of bar modules, filled in a single path
+    module_width = width / len(modules)
+    path = c.beginPath()
+    start = None
+    for i, module in enumerate(modules + "0"):
+        if module == "1" and start is None:
+            start = i
+        elif module == "0" and start is not None:
+            path.rect(x + start * module_width, y, (i - start) * module_width, height)
+            start = None
+    c.drawPath(path, stroke=0, fill=1)
+
+
+def qr_matrix(data, error_correction="M", border=4):
+    # defaults match qrcode.make(); rows of booleans, border included
+    import qrcode
+    level = getattr(qrcode.constants, "ERROR_CORRECT_" + error_correction)
+    qr = qrcode.QRCode(version=None, error_correction=level, border=border)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def datamatrix_matrix(data, quiet_zone=True):
+    # same symbol generate_scaled_datamatrix rasterizes, finder pattern and
+    # (optionally) the 2-module quiet zone included
+    from pystrich.datamatrix import DataMatrixEncoder
+    matrix = DataMatrixEncoder(data).init_renderer().matrix
+    if not quiet_zone:
+        while matrix and not any(matrix[0]):
+            matrix = matrix[1:]
+        while matrix and not any(matrix[-1]):
+            matrix = matrix[:-1]
+        left = min(row.index(1) for row in matrix if any(row))
+        right = max(len(row) - row[::-1].index(1) for row in matrix if any(row))
+        matrix = [row[left:right] for row in matrix]
+    return matrix
+
+
+def draw_matrix(c, matrix, x, y, width, height):
+    # Row 0 is the top of the symbol. Dark runs in each row are merged with
+    # identical runs in the rows below, so solid areas become one rectangle.
+    module_w = width / len(matrix[0])
+    module_h = height / len(matrix)
+    path = c.beginPath()
+    open_runs = {}  # (start, end) -> first row of the rectangle
+
+    def flush(run, first_row, last_row):
+        start, end = run
+        path.rect(
+            x + start * module_w,
+            y + height - (last_row + 1) * module_h,
+            (end - start) * module_w,
+            (last_row - first_row + 1) * module_h,
+        )
+
+    for row_n, row in enumerate(matrix):
+        runs = set()
+        start = None
+        for i, dark in enumerate(list(row) + [0]):
+            if dark and start is None:
+                start = i
+            elif not dark and start is not None:
+                runs.add((start, i))
+                start = None
+        for run in list(open_runs):
+            if run not in runs:
+                flush(run, open_runs.pop(run), row_n - 1)
+        for run in runs:
+            open_runs.setdefault(run, row_n)
+    for run, first_row in open_runs.items():
+        flush(run, first_row, len(matrix) - 1)
+    c.drawPath(path, stroke=0, fill=1)